@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103
+"""
+This module contains admission control for the web server: a WSGI
+middleware which limits number of requests processed at the same time and
+quickly rejects requests over the limits instead of queueing them.
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import threading
+
+from robobattleship.utils import JsonResponse
+from robobattleship.settings import (ADMISSION_MAX_INFLIGHT,
+    ADMISSION_GAMEPLAY_RESERVED, ADMISSION_LIMITS)
+
+
+# First segment of request path -> route group
+ROUTE_GROUPS = {
+    "register": "gameplay",
+    "setships": "gameplay",
+    "shoot": "gameplay",
+    "match": "gameplay",
+    "wait_turn": "longpoll",
+    "static": "static",
+    "stats": "service",
+    "profile": "service",
+    "dumpstate": "service",
+    "export": "service",
+    "healthz": "probe",
+    "readyz": "probe",
+}
+
+# Route groups which are never rejected
+EXEMPT_GROUPS = ("probe",)
+
+# Route groups which don't count towards total number of requests in flight,
+# since their requests mostly wait
+IDLE_GROUPS = ("longpoll",)
+
+
+class AdmissionControl(object):
+    """
+    WSGI middleware which limits number of requests in flight: in total and
+    per route group. Part of the total limit is reserved for gameplay
+    routes, so page renders can't take all capacity. Requests over the
+    limits are rejected right away with error 105.
+    """
+
+    def __init__(self, app, max_inflight=ADMISSION_MAX_INFLIGHT,
+                 reserved=ADMISSION_GAMEPLAY_RESERVED, limits=None):
+        self.app = app
+        self.max_inflight = max_inflight
+        self.reserved = reserved
+        self.limits = limits or ADMISSION_LIMITS
+        self.lock = threading.Lock()
+        self.inflight = 0
+        # route group -> number of requests in flight
+        self.groups = dict((group, 0) for group in self.limits)
+        # route group -> number of rejected requests
+        self.rejected = dict((group, 0) for group in self.limits)
+
+    def __call__(self, environ, start_response):
+        group = self.get_group(environ.get("PATH_INFO", ""))
+        if group in EXEMPT_GROUPS:
+            return self.app(environ, start_response)
+
+        if not self.admit(group):
+            return self.reject(start_response)
+
+        try:
+            result = self.app(environ, start_response)
+        except:
+            self.release(group)
+            raise
+        return ReleasingIterable(result, lambda: self.release(group))
+
+    def get_group(self, path):
+        "Returns route group of given request path"
+        return ROUTE_GROUPS.get(path.lstrip("/").split("/", 1)[0], "pages")
+
+    def admit(self, group):
+        """
+        Returns True and counts request in if request of given route group
+        can be processed.
+        """
+        with self.lock:
+            if self.groups.get(group, 0) >= self.limits.get(group, 0):
+                self.rejected[group] = self.rejected.get(group, 0) + 1
+                return False
+            if group not in IDLE_GROUPS:
+                limit = self.max_inflight
+                if group != "gameplay":
+                    limit -= self.reserved
+                if self.inflight >= limit:
+                    self.rejected[group] = self.rejected.get(group, 0) + 1
+                    return False
+                self.inflight += 1
+            self.groups[group] = self.groups.get(group, 0) + 1
+            return True
+
+    def release(self, group):
+        "Counts finished request of given route group out"
+        with self.lock:
+            if group not in IDLE_GROUPS:
+                self.inflight -= 1
+            self.groups[group] -= 1
+
+    def reject(self, start_response):
+        "Returns overload error response"
+        body = json.dumps(JsonResponse.error(105)).encode("utf-8")
+        start_response(b"503 Service Unavailable", [
+            (b"Content-Type", b"application/json"),
+            (b"Content-Length", str(len(body)).encode("ascii")),
+            (b"Retry-After", b"1"),
+            (b"Access-Control-Allow-Origin", b"*"),
+        ])
+        return [body]
+
+    def stats(self):
+        "Returns numbers of requests in flight and rejected requests"
+        with self.lock:
+            return {
+                "inflight": self.inflight,
+                "groups": dict(self.groups),
+                "rejected": dict(self.rejected),
+            }
+
+
+class ReleasingIterable(object):
+    """
+    Wraps WSGI response iterable and calls release callback once response
+    is sent (streamed responses hold their slot until the end).
+    """
+
+    def __init__(self, iterable, release):
+        self.iterable = iterable
+        self.release = release
+        self.released = False
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+    def close(self):
+        try:
+            if hasattr(self.iterable, "close"):
+                self.iterable.close()
+        finally:
+            if not self.released:
+                self.released = True
+                self.release()
@@ -0,0 +1,587 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103
+"""
+This module contains RoboBattleship Server http views and an application
+factory which wires them into a bottle application.
+
+Game server, templates and other heavy modules are imported on first use,
+so the web server can start listening as soon as possible.
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import functools
+import importlib
+
+from bottle import Bottle, JSONPlugin, request, response
+
+import robobattleship.log
+from robobattleship.settings import RESTORE_FROM, RANDOM_SEED, GZIP_MIN_SIZE
+from robobattleship.utils import (JsonResponse, delay, validate_admin, rss,
+    object_counts)
+from robobattleship.profiler import PROFILER, profiled
+from robobattleship.settings import (PROFILE_MAX_SECONDS, WAIT_TURN_TIMEOUT,
+    SNAPSHOT_BACKGROUND, SNAPSHOT_INTERVAL, STATS_TOP_OBJECTS)
+from robobattleship.errors import RoboBattleshipException, ERRORS
+
+LOG = robobattleship.log.getLogger("robobattleship.main")
+
+# Serializes JSON responses
+json_dumps = profiled("json")(json.dumps)
+
+
+class Context(object):
+    """
+    Holds the state shared by all views: game server instance, built-in bots
+    and startup readiness flags. Game server is created (or restored) during
+    startup, views which use it answer with an error until server is ready.
+    """
+
+    def __init__(self):
+        self.server = None
+        self.bots = []
+        self.snapshotter = None
+        self.admission = None
+        # replication publisher on primary, Replica on read-only replica
+        self.replication = None
+        self.state_restored = False
+        self.templates_warmed_up = False
+
+    def is_ready(self):
+        "Returns True if server finished all startup steps"
+        return self.state_restored and self.templates_warmed_up
+
+
+CONTEXT = Context()
+
+
+def ready_required(func):
+    """
+    Decorator: returns an error instead of calling a view while server is
+    still starting up.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not CONTEXT.is_ready():
+            return JsonResponse.error(102)
+        return func(*args, **kwargs)
+    return wrapper
+
+
+def gzipped(func):
+    """
+    Decorator: serializes JSON response of a view and compresses it with
+    gzip if client accepts it and response is big enough to be worth it.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        from robobattleship.assets import accepts_gzip, gzip_bytes
+
+        result = func(*args, **kwargs)
+        if not isinstance(result, dict):
+            return result
+
+        body = json_dumps(result).encode("utf-8")
+        response.content_type = b'application/json'
+        response.headers[b'Vary'] = b'Accept-Encoding'
+        if len(body) >= GZIP_MIN_SIZE and accepts_gzip(request.environ):
+            body = gzip_bytes(body)
+            response.headers[b'Content-Encoding'] = b'gzip'
+        return body
+    return wrapper
+
+
+def template(name, **context):
+    "Renders a template, templates environment is created on first use"
+    from robobattleship.render import render
+    return render(name, **context)
+
+
+# -----
+# Hooks
+# -----
+
+def enable_crossdomain():
+    "Allow cross domain requests from browsers"
+    response.headers[b'Access-Control-Allow-Origin'] = b'*'
+
+
+# --------------
+# Standard views
+# --------------
+
+@ready_required
+def index():
+    """
+    Shows index page of the server.
+    """
+    try:
+        return template('index.html',
+            players=CONTEXT.server.players.values(),
+            battles=CONTEXT.server.battles.values(),
+            archived_battles=CONTEXT.server.archived_battles.values(),
+            errorcodes=[(code, ERRORS[code]) for code in sorted(ERRORS)])
+    except RoboBattleshipException as e:
+        return JsonResponse.error(e)
+    except:
+        LOG.exception("Failed to show server index page")
+        return JsonResponse.error(101)
+
+def about():
+    """
+    Shows about page
+    """
+    try:
+        return template('about.html')
+    except RoboBattleshipException as e:
+        return JsonResponse.error(e)
+    except:
+        LOG.exception("Failed to show about page")
+        return JsonResponse.error(101)
+
+@ready_required
+def players():
+    """
+    Shows a list of all registered players on the server
+    """
+    try:
+        return template('players.html', players=CONTEXT.server.players.values())
+    except RoboBattleshipException as e:
+        return JsonResponse.error(e)
+    except:
+        LOG.exception("Failed to show a list of all registered players on the "
+            "server")
+        return JsonResponse.error(101)
+
+@ready_required
+def battle(bid):
+    """
+    Shows battle between two players on the screen
+    """
+    try:
+        return template('battle.html', battle=CONTEXT.server.get_battle(bid))
+    except RoboBattleshipException as e:
+        return JsonResponse.error(e)
+    except:
+        LOG.exception("Failed to show battle with bid '%s'", bid)
+        return JsonResponse.error(101)
+
+@ready_required
+@gzipped
+def gameboard(bid):
+    """
+    Shows battle board between two players on the screen
+    """
+    try:
+        battle = CONTEXT.server.get_battle(bid)
+        return JsonResponse.success({"battle": {
+            "active": battle.is_active(),
+            "html": template('gameboard.html', battle=battle)
+        }})
+    except RoboBattleshipException as e:
+        return JsonResponse.error(e)
+    except:
+        LOG.exception("Failed to show game board with bid '%s'", bid)
+        return JsonResponse.error(101)
+
+
+# ------------
+# Static files
+# ------------
+
+def static(filepath):
+    "Serves static files"
+    from robobattleship.assets import serve
+    try:
+        return serve(filepath)
+    except:
+        LOG.exception("Failed to show static file '%s'", filepath)
+        return JsonResponse.error(101)
+
+
+# ----------------
+# REST API methods
+# ----------------
+
+@ready_required
+@delay()
+def register(name):
+    """
+    Registers a new player on the server.
+
+    :param name: player name
+    """
+    try:
+        name = name.decode("utf-8")
+        player = CONTEXT.server.register_player(name)
+        return JsonResponse.success({'player': player.to_dict()})
+    except RoboBattleshipException as e:
+        return JsonResponse.error(e)
+    except:
+        LOG.exception("Failed to register player '%s'", name)
+        return JsonResponse.error(101)
+
+    return JsonResponse.success()
+
+@ready_required
+@delay()
+def setships(uid, secret, ships):
+    """
+    Set player's ships arrangement
+    """
+    try:
+        CONTEXT.server.validate_player(uid, secret)
+        CONTEXT.server.setships(uid, ships)
+    except RoboBattleshipException as e:
+        return JsonResponse.error(e)
+    except:
+        LOG.exception("Failed to set ships '%s' for player '%s'", ships, uid)
+        return JsonResponse.error(101)
+    return JsonResponse.success()
+
+@ready_required
+@delay()
+def shoot(uid, secret, enemy_uid, x, y):
+    """
+    One player shoots at another player.
+    """
+    try:
+        CONTEXT.server.validate_player(uid, secret)
+        result = CONTEXT.server.shoot(uid, enemy_uid, x, y)
+    except RoboBattleshipException as e:
+        return JsonResponse.error(e)
+    except:
+        LOG.exception("Failed to shoot at player '%s' at [%s,%s]",
+            enemy_uid, x, y)
+        return JsonResponse.error(101)
+
+    return JsonResponse.success({'result': result})
+
+@ready_required
+@delay()
+def wait_turn(uid, secret, enemy_uid, timeout=WAIT_TURN_TIMEOUT):
+    """
+    Waits until it's player's turn to shoot at enemy.
+    """
+    try:
+        CONTEXT.server.validate_player(uid, secret)
+        timeout = max(0, min(timeout, WAIT_TURN_TIMEOUT))
+        battle, turn = CONTEXT.server.wait_turn(uid, enemy_uid, timeout)
+    except RoboBattleshipException as e:
+        return JsonResponse.error(e)
+    except:
+        LOG.exception("Failed to wait for turn of player '%s' to shoot at "
+            "player '%s'", uid, enemy_uid)
+        return JsonResponse.error(101)
+
+    return JsonResponse.success({'turn': turn, 'active': battle.is_active()})
+
+@ready_required
+@delay()
+def match(uid, secret):
+    """
+    Puts player into matchmaking queue, returns his opponent and battle id
+    once he is paired with somebody.
+    """
+    try:
+        CONTEXT.server.validate_player(uid, secret)
+        found = CONTEXT.server.match(uid)
+    except RoboBattleshipException as e:
+        return JsonResponse.error(e)
+    except:
+        LOG.exception("Failed to find an opponent for player '%s'", uid)
+        return JsonResponse.error(101)
+
+    if found is None:
+        return JsonResponse.success({'opponent': None, 'bid': None})
+    opponent, bid = found
+    return JsonResponse.success({'opponent': opponent, 'bid': bid})
+
+
+# ---------------
+# Service methods
+# ---------------
+
+def healthz():
+    """
+    Liveness probe: returns success as long as server accepts requests.
+    """
+    return JsonResponse.success()
+
+def readyz():
+    """
+    Readiness probe: returns success only after server state is restored
+    and templates are warmed up.
+    """
+    payload = {"ready": {
+        "state_restored": CONTEXT.state_restored,
+        "templates_warmed_up": CONTEXT.templates_warmed_up,
+    }}
+    if not CONTEXT.is_ready():
+        response.status = 503
+        packet = JsonResponse.error(102)
+        packet.update(payload)
+        return packet
+    return JsonResponse.success(payload)
+
+def stats(secret=None):
+    """
+    Returns server statistics. Numbers of objects per type are counted only
+    for administrator (stats/<secret>) if objects query parameter is given,
+    since walking the whole heap blocks all requests for a while.
+    """
+    try:
+        from robobattleship.render import stats as templates_stats
+        memory = {"rss": rss()}
+        if request.query.objects in ("1", "true", "yes"):
+            validate_admin(secret)
+            counts = object_counts()
+            memory["objects"] = sum(counts.values())
+            memory["types"] = dict(counts.most_common(STATS_TOP_OBJECTS))
+        return JsonResponse.success({"stats": {
+            "server": CONTEXT.server.stats() if CONTEXT.server else None,
+            "memory": memory,
+            "templates": templates_stats(),
+            "logging": robobattleship.log.stats(),
+            "admission": (CONTEXT.admission.stats()
+                          if CONTEXT.admission else None),
+            "replication": (CONTEXT.replication.stats()
+                            if CONTEXT.replication else None),
+        }})
+    except RoboBattleshipException as e:
+        return JsonResponse.error(e)
+    except:
+        LOG.exception("Failed to collect server statistics")
+        return JsonResponse.error(101)
+
+def profile(secret, seconds):
+    """
+    Runs profiler for given number of seconds and returns its report.
+    """
+    try:
+        validate_admin(secret)
+        seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+        return JsonResponse.success({"profile": PROFILER.run(seconds)})
+    except RoboBattleshipException as e:
+        return JsonResponse.error(e)
+    except:
+        LOG.exception("Failed to profile server")
+        return JsonResponse.error(101)
+
+@ready_required
+def export_battles():
+    """
+    Streams archived battles as newline-delimited JSON. Accepts optional
+    query parameters: since, until, player and gzip.
+    """
+    from robobattleship.export import export, parse_time
+    try:
+        since = parse_time(request.query.since)
+        until = parse_time(request.query.until)
+        gzip = request.query.gzip in ("1", "true", "yes")
+        chunks = export(CONTEXT.server, since, until,
+            request.query.player or None, gzip)
+    except RoboBattleshipException as e:
+        return JsonResponse.error(e)
+    except:
+        LOG.exception("Failed to export battles")
+        return JsonResponse.error(101)
+
+    response.content_type = b'application/x-ndjson'
+    if gzip:
+        response.headers[b'Content-Encoding'] = b'gzip'
+    return chunks
+
+@delay()
+def dumpstate(filename=None):
+    """
+    Dumps server state into a file. Dump is written in background if
+    SNAPSHOT_BACKGROUND setting is on, its progress is reported by
+    dumpstate_status.
+    """
+    try:
+        if SNAPSHOT_BACKGROUND:
+            CONTEXT.snapshotter.start(CONTEXT.server, filename)
+        else:
+            CONTEXT.server.dumpstate(filename)
+    except RoboBattleshipException as e:
+        return JsonResponse.error(e)
+    except:
+        LOG.exception("Failed to dump server state")
+        return JsonResponse.error(101)
+    return JsonResponse.success()
+
+def dumpstate_status():
+    """
+    Returns status of background server state dump.
+    """
+    return JsonResponse.success({"snapshot": CONTEXT.snapshotter.status()})
+
+
+# -----------
+# Application
+# -----------
+
+def create_app(readonly=False):
+    """
+    Creates a bottle application with all RoboBattleship views. Read-only
+    application (for a replica) has only views which don't change state.
+    """
+    app = Bottle()
+    app.install(JSONPlugin(json_dumps=json_dumps))
+    app.hook('after_request')(enable_crossdomain)
+
+    app.route('/')(index)
+    app.route('/about/')(about)
+    app.route('/players/')(players)
+    app.route('/battle/<bid>')(battle)
+    app.route('/gameboard/<bid>')(gameboard)
+
+    app.route('/static/<filepath:path>')(static)
+
+    app.route('/healthz')(healthz)
+    app.route('/readyz')(readyz)
+    app.route('/stats/')(stats)
+    app.route('/stats/<secret>')(stats)
+    app.route('/export/battles')(export_battles)
+    if readonly:
+        return app
+
+    from robobattleship.snapshot import Snapshotter
+    CONTEXT.snapshotter = Snapshotter()
+
+    app.route('/register/<name>')(register)
+    app.route('/setships/<uid>/<secret>/<ships>')(setships)
+    app.route('/shoot/<uid>/<secret>/<enemy_uid>/<x:int>/<y:int>')(shoot)
+    app.route('/wait_turn/<uid>/<secret>/<enemy_uid>')(wait_turn)
+    app.route('/wait_turn/<uid>/<secret>/<enemy_uid>/<timeout:int>')(wait_turn)
+    app.route('/match/<uid>/<secret>')(match)
+
+    app.route('/profile/<secret>/<seconds:int>')(profile)
+    app.route('/dumpstate/')(dumpstate)
+    app.route('/dumpstate/status/')(dumpstate_status)
+    app.route('/dumpstate/<filename>')(dumpstate)
+    return app
+
+
+def restore_state():
+    """
+    Restores server state from a dump module configured in settings (if
+    any), otherwise creates an empty game server.
+    """
+    if RESTORE_FROM:
+        LOG.info("Restoring server state from '%s'", RESTORE_FROM)
+        CONTEXT.server = importlib.import_module(RESTORE_FROM).server
+        # dumps don't keep random state, battles created after restore are
+        # seeded from settings too
+        CONTEXT.server.random.seed(RANDOM_SEED)
+    else:
+        from robobattleship.server import Server
+        CONTEXT.server = Server(seed=RANDOM_SEED)
+    CONTEXT.state_restored = True
+
+
+def warmup():
+    "Loads and compiles all templates"
+    import robobattleship.render
+    robobattleship.render.warmup()
+    CONTEXT.templates_warmed_up = True
+
+
+def start_bots():
+    """
+    Starts built-in bots. Must be called after the web server started
+    listening, since bots connect to it.
+    """
+    from robobattleship.auth import issue_token
+    from robobattleship.players.stupid import StupidBot
+
+    # tokens are signed here, so bots can authenticate even if they are
+    # already registered (e.g. after state restore)
+    CONTEXT.bots = [
+        StupidBot(name="Garry (bot)", uid="uid-63aaf540",
+                  secret=issue_token("uid-63aaf540")),
+        StupidBot(name="Barry (bot)", uid="uid-566f73bf",
+                  secret=issue_token("uid-566f73bf")),
+    ]
+    for bot in CONTEXT.bots:
+        bot.start()
+
+
+def stop_bots():
+    "Tells built-in bots to stop fighting"
+    for bot in CONTEXT.bots:
+        bot.stop_fight()
+
+
+def startup():
+    """
+    Runs startup steps in background while web server already answers
+    health probes: restores state, warms up templates, then starts
+    replication, background jobs and built-in bots.
+    """
+    import gevent
+    from gevent.server import StreamServer
+    from robobattleship.replication import Publisher
+    from robobattleship.settings import REPLICATION_HOST, REPLICATION_PORT
+
+    try:
+        restore_state()
+        # let waiting probes be answered between startup steps
+        gevent.sleep(0)
+        warmup()
+    except:
+        LOG.exception("Failed to start RoboBattleship Web Server")
+        return
+    LOG.info("RoboBattleship Web Server is ready")
+
+    if REPLICATION_PORT:
+        CONTEXT.replication = Publisher(CONTEXT)
+        CONTEXT.server.publisher = CONTEXT.replication
+        LOG.info("Publishing state changes to replicas on {host}:{port}"
+            .format(host=REPLICATION_HOST, port=REPLICATION_PORT))
+        StreamServer((REPLICATION_HOST, REPLICATION_PORT),
+                     CONTEXT.replication).start()
+
+    # Expire stalled battles in background
+    gevent.spawn(CONTEXT.server.expiry.run, CONTEXT.server.expire_battle)
+
+    if SNAPSHOT_INTERVAL:
+        gevent.spawn(CONTEXT.snapshotter.run_periodic,
+                     lambda: CONTEXT.server, SNAPSHOT_INTERVAL)
+
+    start_bots()
+
+
+def main():
+    """
+    Runs RoboBattleship web server: starts listening first, so health
+    probes are answered right away, and runs the rest of startup in
+    background.
+    """
+    import gevent
+    from gevent.pywsgi import WSGIServer
+    from gevent.server import StreamServer
+    from robobattleship.stream import StreamHandler
+    from robobattleship.admission import AdmissionControl
+    from robobattleship.settings import HOST, PORT, STREAM_PORT
+
+    app = create_app()
+    CONTEXT.admission = AdmissionControl(app)
+    webserver = WSGIServer((HOST, PORT), CONTEXT.admission)
+    streamserver = StreamServer((HOST, STREAM_PORT), StreamHandler(CONTEXT))
+
+    LOG.info("Starting RoboBattleship Web Server on {host}:{port}"
+        .format(host=HOST, port=PORT))
+    webserver.start()
+    LOG.info("Accepting persistent bot connections on {host}:{port}"
+        .format(host=HOST, port=STREAM_PORT))
+    streamserver.start()
+
+    gevent.spawn(startup)
+    try:
+        webserver.serve_forever()
+    finally:
+        # Stop fighting after webserver terminates
+        stop_bots()
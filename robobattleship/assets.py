@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103
+"""
+This module contains serving of static files: content-hashed urls which can
+be cached forever, ETag revalidation and prebuilt gzip variants of files.
+
+Gzip variants are built next to the original files by running the module
+as a script (again after static files change):
+
+    $ python -m robobattleship.assets
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import zlib
+import hashlib
+import argparse
+import mimetypes
+
+from bottle import HTTPResponse, request, static_file
+
+from robobattleship.settings import (STATIC_ROOT, STATIC_MAX_AGE,
+    STATIC_FINGERPRINTED_MAX_AGE, STATIC_GZIP_EXTENSIONS, GZIP_LEVEL)
+
+
+# Length of content hash in static urls and ETags
+HASH_LENGTH = 12
+
+# file path -> (modification time, content hash)
+HASHES = {}
+
+# static file path -> url with content hash, filled by load_urls() so
+# rendering templates doesn't touch the disk
+URLS = {}
+
+
+def fingerprint(filepath, root=STATIC_ROOT):
+    """
+    Returns hash of content of a static file with given path relative to
+    root. Returns None if there is no such file. Hashes are recalculated
+    only when a file changes.
+    """
+    root = os.path.abspath(root) + os.sep
+    filename = os.path.abspath(os.path.join(root, filepath.strip("/\\")))
+    if not filename.startswith(root) or not os.path.isfile(filename):
+        return None
+
+    mtime = os.path.getmtime(filename)
+    cached = HASHES.get(filename)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    md5 = hashlib.md5()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            md5.update(chunk)
+    digest = md5.hexdigest()[:HASH_LENGTH]
+    HASHES[filename] = (mtime, digest)
+    return digest
+
+
+def hashed_url(filepath, root=STATIC_ROOT):
+    "Returns url of a static file with its current content hash"
+    digest = fingerprint(filepath, root)
+    url = "/static/" + filepath.lstrip("/")
+    if digest is None:
+        return url
+    return "%s?v=%s" % (url, digest)
+
+
+def load_urls(root=STATIC_ROOT):
+    """
+    Hashes all static files (except gzip variants) and keeps their urls in
+    memory. Returns number of files.
+    """
+    urls = {}
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            if name.endswith(".gz"):
+                continue
+            filepath = os.path.relpath(os.path.join(dirpath, name), root)
+            filepath = filepath.replace(os.sep, "/")
+            urls[filepath] = hashed_url(filepath, root)
+    URLS.clear()
+    URLS.update(urls)
+    return len(urls)
+
+
+def static_url(filepath):
+    """
+    Returns url of a static file with its content hash, so the url changes
+    whenever the file does and browsers can cache it forever. Hashes are
+    taken at startup (see load_urls), files added later get plain urls.
+    """
+    url = URLS.get(filepath.strip("/"))
+    if url is None:
+        return "/static/" + filepath.lstrip("/")
+    return url
+
+
+def accepts_gzip(environ):
+    "Returns True if client accepts gzip-encoded responses"
+    for coding in environ.get("HTTP_ACCEPT_ENCODING", "").split(","):
+        params = [p.strip() for p in coding.split(";")]
+        if params[0].lower() not in ("gzip", "*"):
+            continue
+        for param in params[1:]:
+            if param.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+                return False
+        return True
+    return False
+
+
+def gzip_bytes(data, level=GZIP_LEVEL):
+    "Returns data compressed into gzip format"
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def serve(filepath, root=STATIC_ROOT):
+    """
+    Returns response with a static file. Answers 304 if client has the same
+    version of the file, serves prebuilt gzip variant of the file if there
+    is one and client accepts it. Files requested with their content hash
+    are cached forever.
+    """
+    digest = fingerprint(filepath, root)
+    if digest is None:
+        return static_file(filepath, root=root)
+
+    if request.query.v == digest:
+        cache_control = "public, max-age=%s" % STATIC_FINGERPRINTED_MAX_AGE
+    else:
+        cache_control = "public, max-age=%s" % STATIC_MAX_AGE
+
+    gzipped = accepts_gzip(request.environ) and has_gzip(filepath, root)
+    etag = '"%s%s"' % (digest, "-gz" if gzipped else "")
+    headers = {
+        b"ETag": etag.encode("ascii"),
+        b"Cache-Control": cache_control.encode("ascii"),
+        b"Vary": b"Accept-Encoding",
+    }
+
+    if etag in [tag.strip() for tag in
+                request.environ.get("HTTP_IF_NONE_MATCH", "").split(",")]:
+        return HTTPResponse(status=304, **headers)
+
+    if gzipped:
+        mimetype = mimetypes.guess_type(filepath)[0] or "text/plain"
+        result = static_file(filepath + ".gz", root=root, mimetype=mimetype)
+        headers[b"Content-Encoding"] = b"gzip"
+    else:
+        result = static_file(filepath, root=root)
+
+    if result.status_code in (200, 304):
+        for name, value in headers.items():
+            result.set_header(name, value)
+    return result
+
+
+def has_gzip(filepath, root=STATIC_ROOT):
+    "Returns True if a static file has an up to date gzip variant"
+    filename = os.path.join(root, filepath.strip("/\\"))
+    return (os.path.isfile(filename + ".gz") and
+            os.path.getmtime(filename + ".gz") >= os.path.getmtime(filename))
+
+
+def build(root=STATIC_ROOT, level=9):
+    """
+    Writes gzip variants of compressible static files which don't have up
+    to date ones. Returns a list of written file paths.
+    """
+    written = []
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            if os.path.splitext(name)[1] not in STATIC_GZIP_EXTENSIONS:
+                continue
+            filepath = os.path.relpath(os.path.join(dirpath, name), root)
+            if has_gzip(filepath, root):
+                continue
+            with open(os.path.join(dirpath, name), "rb") as f:
+                data = gzip_bytes(f.read(), level)
+            with open(os.path.join(dirpath, name + ".gz"), "wb") as f:
+                f.write(data)
+            written.append(filepath + ".gz")
+    return written
+
+
+def main():
+    "Builds gzip variants of static files"
+    parser = argparse.ArgumentParser(
+        description="Build gzip variants of static files")
+    parser.add_argument("--root", default=STATIC_ROOT,
+                        help="static files root directory")
+    parser.add_argument("--level", type=int, default=9,
+                        help="compression level")
+    args = parser.parse_args()
+
+    for filepath in build(args.root, args.level):
+        print(filepath)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103
+"""
+This module contains stateless player authentication tokens.
+
+Token has the form "<uid>.<signature>" where signature is an HMAC of the
+uid, so any process which knows AUTH_SECRET_KEY can verify a token without
+looking up the player.
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import hmac
+import hashlib
+
+from robobattleship.utils import constant_time_compare
+from robobattleship.settings import AUTH_SECRET_KEY, AUTH_SIGNATURE_LENGTH
+
+TOKEN_SEPARATOR = "."
+
+
+def sign(uid):
+    "Returns signature of given player uid"
+    return hmac.new(AUTH_SECRET_KEY.encode("utf-8"), uid.encode("utf-8"),
+                    hashlib.sha256).hexdigest()[:AUTH_SIGNATURE_LENGTH]
+
+
+def issue_token(uid):
+    "Returns a new token for player with given uid"
+    return "{uid}{sep}{signature}".format(uid=uid, sep=TOKEN_SEPARATOR,
+                                          signature=sign(uid))
+
+
+def is_token(secret):
+    "Returns True if given player secret is a signed token"
+    return TOKEN_SEPARATOR in secret
+
+
+def verify_token(uid, token):
+    """
+    Returns True if token is valid and was issued to player with given uid.
+    """
+    token_uid, _, signature = token.rpartition(TOKEN_SEPARATOR)
+    return token_uid == uid and constant_time_compare(signature, sign(uid))
@@ -7,10 +7,13 @@ about battle state between two players.
 from __future__ import print_function
 from __future__ import unicode_literals
 
-from random import choice
+import time
+import random
 from datetime import datetime
+from threading import Event, Lock
 
 from robobattleship.errors import BattleException
+from robobattleship.profiler import profiled
 
 
 CELL_EMPTY = '0'
@@ -23,22 +26,75 @@ class Battle(object):
     RoboBattleship Battle class which holds state of battle between two players
     """
 
-    def __init__(self, player_with_ships1, player_with_ships2):
+    __slots__ = ('player1', 'player2', 'bid', 'winner', 'looser', 'notified',
+                 'created', 'finished', 'shots', 'shooter', 'opponent',
+                 'turn_events', 'lock', 'seed')
+
+    def __init__(self, player_with_ships1, player_with_ships2, bid=None,
+                 shooter_uid=None, winner_uid=None, created=None,
+                 finished=None, shots=None, seed=None):
         self.player1 = player_with_ships1
         self.player2 = player_with_ships2
-        self.bid = self.generate_bid(self.player1.uid, self.player2.uid)
+        self.bid = bid or self.generate_bid(self.player1.uid,
+                                            self.player2.uid)
         self.winner = None
         self.looser = None
+        # uids of players who were told that battle is over
+        self.notified = set()
+
+        # time when battle started and finished (unix timestamps)
+        self.created = created or time.time()
+        self.finished = finished
+        # shot log: list of (time, shooter uid, x, y, result) tuples
+        self.shots = shots or []
+
+        # seed of random choices made in the battle, it is recorded so the
+        # battle can be replayed; battles restored without a seed have none,
+        # their shooter wasn't chosen by it
+        if seed is None and shooter_uid is None:
+            seed = random.getrandbits(32)
+        self.seed = seed
 
         # randomly choose shooter and opponent
-        self.shooter = choice([self.player1, self.player2])
+        if shooter_uid is None:
+            self.shooter = random.Random(self.seed).choice(
+                [self.player1, self.player2])
+        else:
+            self.shooter = self.get_player(shooter_uid)
         self.opponent = self.player1 if self.shooter == self.player2 \
                                      else self.player2
 
-    def shoot(self, shooter_uid, x, y):
+        # uid -> event which is set while it's player's turn to shoot (or
+        # battle is over)
+        self.turn_events = {self.player1.uid: Event(),
+                            self.player2.uid: Event()}
+        self.turn_events[self.shooter.uid].set()
+
+        # guards battle state: players and their ships
+        self.lock = Lock()
+
+        if winner_uid is not None:
+            self.winner = self.get_player(winner_uid)
+            self.looser = self.player1 if self.winner == self.player2 \
+                                       else self.player2
+            self.notified.update([self.player1.uid, self.player2.uid])
+            self.compact()
+
+    @profiled("Battle.shoot")
+    def shoot(self, shooter_uid, x, y, callback=None):
         """
-        One player shoots at another player.
+        One player shoots at another player. Callback (if any) is called
+        with the battle while it is still locked, so callbacks of all shots
+        are called in order.
         """
+        with self.lock:
+            status = self._shoot(shooter_uid, x, y)
+            if callback is not None:
+                callback(self)
+            return status
+
+    def _shoot(self, shooter_uid, x, y):
+        "Shoots without locking, see shoot()"
         if not self.is_active():
             raise BattleException(304, winner=self.winner, looser=self.looser)
 
@@ -55,17 +111,70 @@ class Battle(object):
         if self.is_shipdown(x, y, self.opponent.ships):
             status = 'touchdown'
 
+        now = time.time()
         if self.is_shooter_win():
             self.winner = self.shooter
             self.looser = self.opponent
+            self.finished = now
+            self.wake_all()
             status = 'win'
 
+        self.shots.append((now, shooter_uid, x, y, status))
+
         if status == 'miss':
             # swap players
             self.shooter, self.opponent = self.opponent, self.shooter
+            self.turn_events[self.opponent.uid].clear()
+            self.turn_events[self.shooter.uid].set()
 
         return status
 
+    def wait_turn(self, uid, timeout=None):
+        """
+        Waits until it's turn of player with given uid to shoot or battle is
+        over, but no longer than timeout seconds. Returns True if it's
+        player's turn to shoot.
+        """
+        event = self.turn_events.get(uid)
+        if event is None:
+            # battle is archived
+            return False
+        event.wait(timeout)
+        return self.is_active() and self.shooter.uid == uid
+
+    def compact(self):
+        """
+        Wakes up waiting players and frees state which is needed only while
+        battle is active.
+        """
+        self.wake_all()
+        self.turn_events = {}
+
+    def get_player(self, uid):
+        "Returns player with given uid"
+        return self.player1 if self.player1.uid == uid else self.player2
+
+    def wake_all(self):
+        "Wakes up all players waiting for their turn"
+        for event in self.turn_events.values():
+            event.set()
+
+    def forfeit(self, uid):
+        """
+        Player with given uid gives up, his opponent wins the battle.
+        """
+        with self.lock:
+            if not self.is_active():
+                raise BattleException(304, winner=self.winner,
+                                      looser=self.looser)
+
+            if self.player1.uid == uid:
+                self.winner, self.looser = self.player2, self.player1
+            else:
+                self.winner, self.looser = self.player1, self.player2
+            self.finished = time.time()
+            self.wake_all()
+
     def is_shipdown(self, x, y, ships):
         """
         Returns true if all cells of ship were hit.
@@ -130,5 +239,12 @@ class Battle(object):
             .format(player1=self.shooter, player2=self.opponent)
 
     def __repr__(self):
-        return "Battle({player1}, {player2})" \
-            .format(player1=repr(self.shooter), player2=repr(self.opponent))
+        return ("Battle({player1}, {player2}, bid={bid}, "
+                "shooter_uid={shooter_uid}, winner_uid={winner_uid}, "
+                "created={created}, finished={finished}, seed={seed},\n"
+                "shots={shots})"
+            .format(player1=repr(self.player1), player2=repr(self.player2),
+                bid=repr(self.bid), shooter_uid=repr(self.shooter.uid),
+                winner_uid=repr(self.winner.uid if self.winner else None),
+                created=repr(self.created), finished=repr(self.finished),
+                seed=repr(self.seed), shots=repr(self.shots)))
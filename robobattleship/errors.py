@@ -29,6 +29,10 @@ ERRORS = {
     101: "Unexpected error occured. This shouldn't happen, "
          "please, contact server administrator at {email}." \
          .format(email=ADMIN_EMAIL),
+    102: "Server is starting up, try again later",
+    103: "Profiler is already running",
+    104: "Server state snapshot is already being written",
+    105: "Server is overloaded, try again later",
 
     # Data validation errors
     201: "Not enough parameters",
@@ -47,6 +51,12 @@ ERRORS = {
     212: "Ships string must contain only '0' and '1' characters",
     213: "Player name is too long, maximum length is {maxlength} characters",
     214: "Player name is too short, minimum length is {minlength} characters",
+    215: "Invalid administrator secret",
+    216: "Unknown command",
+    217: "Connection is not authenticated, send AUTH command first",
+    218: "Invalid time '{value}', use unix timestamp or YYYY-MM-DD[THH:MM:SS] "
+         "format",
+    219: "Command line is too long, maximum length is {maxlength} bytes",
 
     # Battle errors
     301: "It's not your turn to shoot, wait until your opponent shoots and "
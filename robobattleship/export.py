@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103
+"""
+This module contains export of archived battles as newline-delimited JSON.
+
+Battles are serialized one by one by generators, so memory usage doesn't
+depend on the size of the archive. Can be run as a script to export
+battles from a server dump file:
+
+    $ python -m robobattleship.export robobattleship/dumps/latest.py \\
+        --since 2013-04-01 --player uid-63aaf540 --gzip > battles.ndjson.gz
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import sys
+import json
+import time
+import zlib
+import runpy
+import argparse
+from datetime import datetime
+
+from robobattleship.errors import ValidationException
+
+
+def battle_to_dict(battle):
+    """
+    Returns information about a battle as a dictionary.
+    """
+    return {
+        "bid": battle.bid,
+        "players": [{
+            "uid": player.uid,
+            "name": player.name,
+            "ships": ["".join(row) for row in player.ships],
+        } for player in (battle.player1, battle.player2)],
+        "winner": battle.winner.uid if battle.winner else None,
+        "looser": battle.looser.uid if battle.looser else None,
+        "created": battle.created,
+        "finished": battle.finished,
+        "seed": battle.seed,
+        "shots": [{"time": shottime, "uid": uid, "x": x, "y": y,
+                   "result": result}
+                  for shottime, uid, x, y, result in battle.shots],
+    }
+
+
+def iter_battles(server, since=None, until=None, player=None):
+    """
+    Yields archived battles of the server which finished in [since, until]
+    time range (unix timestamps) and were played by player with given uid.
+    """
+    with server.lock:
+        bids = list(server.archived_battles)
+
+    for bid in bids:
+        battle = server.archived_battles.get(bid)
+        if battle is None:
+            continue
+        finished = battle.finished or battle.created
+        if since is not None and finished < since:
+            continue
+        if until is not None and finished > until:
+            continue
+        if player is not None and \
+                player not in (battle.player1.uid, battle.player2.uid):
+            continue
+        yield battle
+
+
+def iter_ndjson(battles):
+    "Yields every battle as a line of JSON"
+    for battle in battles:
+        yield json.dumps(battle_to_dict(battle)) + "\n"
+
+
+def iter_gzip(chunks, level=6):
+    "Yields gzip-compressed chunks of data"
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export(server, since=None, until=None, player=None, gzip=False):
+    """
+    Yields chunks of exported archived battles: lines of JSON, or gzipped
+    data if gzip is True.
+    """
+    chunks = iter_ndjson(iter_battles(server, since, until, player))
+    if gzip:
+        return iter_gzip(chunks)
+    return (chunk.encode("utf-8") for chunk in chunks)
+
+
+def parse_time(value):
+    """
+    Parses time given as a unix timestamp or a date in YYYY-MM-DD or
+    YYYY-MM-DDTHH:MM:SS format and returns a unix timestamp. Returns None
+    for empty value.
+    """
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    for fmt in ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%d"):
+        try:
+            return time.mktime(datetime.strptime(value, fmt).timetuple())
+        except ValueError:
+            pass
+    raise ValidationException(218, value=value)
+
+
+def main():
+    "Exports archived battles from a server dump file to stdout"
+    parser = argparse.ArgumentParser(
+        description="Export archived battles as newline-delimited JSON")
+    parser.add_argument("dumpfile", help="server dump file")
+    parser.add_argument("--since", help="only battles finished since given "
+                        "time (unix timestamp or YYYY-MM-DD[THH:MM:SS])")
+    parser.add_argument("--until", help="only battles finished until given "
+                        "time")
+    parser.add_argument("--player", help="only battles of player with given "
+                        "uid")
+    parser.add_argument("--gzip", action="store_true",
+                        help="compress output with gzip")
+    args = parser.parse_args()
+
+    server = runpy.run_path(args.dumpfile)["server"]
+    output = getattr(sys.stdout, "buffer", sys.stdout)
+    for chunk in export(server, parse_time(args.since),
+                        parse_time(args.until), args.player, args.gzip):
+        output.write(chunk)
+
+
+if __name__ == "__main__":
+    main()
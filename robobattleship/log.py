@@ -2,15 +2,211 @@
 # pylint: disable=C0103
 """
 This module contains logger configuration and helper functions.
+
+Handlers configured in settings never run on a request greenlet: loggers
+only put records into a queue and a writer running in a real OS thread
+(even when gevent has patched threading, see robobattleship.unpatched)
+passes them to handlers, so disk writes and log rotation don't block the
+event loop. Records below WARNING level are sampled, so a hot path can't
+flood the queue.
 """
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import copy
+import atexit
 import logging
 import logging.config
+from collections import deque
+
+from robobattleship import unpatched
+
+from robobattleship.settings import (LOGGING, LOG_QUEUE_SIZE,
+    LOG_SAMPLE_RATE, LOG_POLL_INTERVAL)
+
+
+class LogWriter(object):
+    """
+    Writes log records from a queue to their handlers in a real OS thread.
+    Records which don't fit into the queue are dropped and counted.
+
+    The queue is a deque, which is safe to use from different threads
+    without locks: putting a record never waits for the writer, and the
+    writer polls the queue instead of waiting on a (possibly patched)
+    condition.
+    """
+
+    def __init__(self, size=LOG_QUEUE_SIZE):
+        self.size = size
+        self.queue = deque()
+        self.running = False
+        # held by writer thread while it runs
+        self.done = None
+        # write records in the logging thread instead of queueing them
+        self.inline = False
+        self.dropped = 0
+
+    def put(self, handlers, record):
+        "Puts a record into the queue without blocking"
+        if self.inline:
+            self.write(handlers, record)
+            return
+        if len(self.queue) >= self.size:
+            self.dropped += 1
+            return
+        self.queue.append((handlers, record))
+
+    def start(self):
+        "Starts writer thread"
+        self.running = True
+        self.done = unpatched.allocate_lock()
+        self.done.acquire()
+        unpatched.start_new_thread(self.run, ())
+
+    def stop(self):
+        "Writes all queued records and stops writer thread"
+        if not self.running:
+            return
+        self.running = False
+        self.done.acquire()
+        self.done.release()
+
+    def run(self):
+        "Writer loop, writes records until stopped and the queue is empty"
+        try:
+            while self.running or self.queue:
+                try:
+                    handlers, record = self.queue.popleft()
+                except IndexError:
+                    unpatched.sleep(LOG_POLL_INTERVAL)
+                    continue
+                self.write(handlers, record)
+        finally:
+            self.done.release()
+
+    def write(self, handlers, record):
+        "Passes a record to handlers which accept its level"
+        for handler in handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def after_fork(self):
+        """
+        Makes writer usable in a forked child process, which has no writer
+        thread: records are written right away. Records queued by the
+        parent are left to the parent.
+        """
+        self.queue.clear()
+        self.running = False
+        self.inline = True
+
+
+class QueueHandler(logging.Handler):
+    """
+    Log handler which passes records to a LogWriter instead of writing them.
+    Records are prepared for the queue the way stdlib QueueHandler does it:
+    message is merged with its arguments and exception is formatted, so
+    queued records don't keep arguments and tracebacks alive and aren't
+    formatted in another thread.
+    """
+
+    def __init__(self, writer, handlers):
+        super(QueueHandler, self).__init__()
+        self.writer = writer
+        self.handlers = handlers
 
-from robobattleship.settings import LOGGING
+    def prepare(self, record):
+        "Returns a copy of a record without arguments and exception info"
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = FORMATTER.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        self.writer.put(self.handlers, self.prepare(record))
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Lets through at most `rate` records per second with the same message
+    template. WARNING and higher records are never dropped.
+    """
+
+    def __init__(self, rate=LOG_SAMPLE_RATE):
+        super(SamplingFilter, self).__init__()
+        self.rate = rate
+        # (logger name, message template) -> [second, number of records]
+        self.windows = {}
+        self.dropped = 0
+
+    def filter(self, record):
+        if not self.rate or record.levelno >= logging.WARNING:
+            return True
+
+        second = int(record.created)
+        key = (record.name, record.msg)
+        window = self.windows.get(key)
+        if window is None or window[0] != second:
+            self.windows[key] = [second, 1]
+            return True
+        if window[1] < self.rate:
+            window[1] += 1
+            return True
+
+        self.dropped += 1
+        return False
+
+
+def install_queue(writer, sampler):
+    """
+    Replaces handlers of all configured loggers with queue handlers.
+    """
+    for name in LOGGING['loggers']:
+        logger = logging.getLogger(name)
+        if logger.handlers:
+            handler = QueueHandler(writer, logger.handlers)
+            handler.addFilter(sampler)
+            logger.handlers = [handler]
+
+
+def after_fork():
+    """
+    Makes logging usable in a forked child process: there is no writer
+    thread in it, and handler locks might have been held by the writer
+    thread of the parent at fork time.
+    """
+    for name in LOGGING['loggers']:
+        for handler in logging.getLogger(name).handlers:
+            for target in getattr(handler, "handlers", []):
+                target.createLock()
+    WRITER.after_fork()
+
+
+def stats():
+    "Returns numbers of dropped log records"
+    return {
+        "queued": len(WRITER.queue),
+        "dropped_queue_full": WRITER.dropped,
+        "dropped_sampled": SAMPLER.dropped,
+    }
+
+
+# Formats exceptions of queued records, handlers append the text as is
+FORMATTER = logging.Formatter()
 
 # Configure logger
 logging.config.dictConfig(LOGGING)
 getLogger = logging.getLogger
+
+WRITER = LogWriter()
+SAMPLER = SamplingFilter()
+install_queue(WRITER, SAMPLER)
+WRITER.start()
+atexit.register(WRITER.stop)
+if unpatched.PATCHED:
+    getLogger(__name__).warning("Log writer runs in a greenlet: "
+        "robobattleship.unpatched was imported after gevent monkey patching")
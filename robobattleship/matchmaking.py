@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103
+"""
+This module contains RoboBattleship matchmaking queue which pairs players
+waiting for a battle.
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import time
+import heapq
+import itertools
+
+from robobattleship.settings import (MATCH_RATING_BUCKET, MATCH_RATING_WINDOW,
+    MATCH_QUEUE_TIMEOUT)
+
+
+class Matchmaker(object):
+    """
+    Matchmaking queue. Waiting players are grouped into buckets by rating,
+    every bucket is a heap ordered by time of enqueueing, so a player is
+    paired with the longest waiting player of the closest rating bucket.
+
+    Both enqueueing and pairing take O(log N), since only a fixed number of
+    neighbouring buckets is looked at.
+    """
+
+    def __init__(self, bucket_size=MATCH_RATING_BUCKET,
+                 window=MATCH_RATING_WINDOW, timeout=MATCH_QUEUE_TIMEOUT):
+        self.bucket_size = bucket_size
+        self.window = window
+        self.timeout = timeout
+        # rating bucket -> heap of
+        #   [enqueued time, sequence number, uid, last seen time]
+        self.buckets = {}
+        # uid -> heap entry of waiting player
+        self.waiting = {}
+        self.counter = itertools.count()
+
+    def enqueue(self, uid, rating):
+        """
+        Puts player with given uid and rating into the queue. Returns uid of
+        an opponent if a waiting player was found (both players leave the
+        queue then), returns None otherwise.
+
+        Enqueueing player who is already waiting only marks him as still
+        available.
+        """
+        now = time.time()
+        entry = self.waiting.get(uid)
+        if entry is not None:
+            entry[3] = now
+            return None
+
+        bucket = self.bucket(rating)
+        for distance in range(self.window + 1):
+            for candidate in set([bucket - distance, bucket + distance]):
+                opponent = self.pop(candidate, now)
+                if opponent is not None:
+                    return opponent
+
+        entry = [now, next(self.counter), uid, now]
+        heapq.heappush(self.buckets.setdefault(bucket, []), entry)
+        self.waiting[uid] = entry
+        return None
+
+    def pop(self, bucket, now):
+        """
+        Removes the longest waiting available player from given rating
+        bucket and returns his uid. Returns None if bucket is empty.
+        """
+        heap = self.buckets.get(bucket)
+        while heap:
+            entry = heapq.heappop(heap)
+            uid = entry[2]
+            if uid is None:
+                # cancelled entry
+                continue
+            del self.waiting[uid]
+            if now - entry[3] > self.timeout:
+                # player stopped polling the queue, he is gone
+                continue
+            if not heap:
+                del self.buckets[bucket]
+            return uid
+        self.buckets.pop(bucket, None)
+        return None
+
+    def cancel(self, uid):
+        "Removes player with given uid from the queue"
+        entry = self.waiting.pop(uid, None)
+        if entry is not None:
+            # entry is removed from its heap lazily
+            entry[2] = None
+
+    def bucket(self, rating):
+        "Returns bucket number for given rating"
+        return int(rating // self.bucket_size)
+
+    def __contains__(self, uid):
+        return uid in self.waiting
+
+    def __len__(self):
+        return len(self.waiting)
@@ -8,18 +8,22 @@ from __future__ import unicode_literals
 
 import hashlib
 
+from robobattleship.auth import issue_token
+
 
 class PlayerWithShips(object):
     """
     Wrapper which wraps player and his current ships arrangement
     """
 
+    __slots__ = ('player', 'ships', 'uid', 'name')
+
     def __init__(self, player, ships):
         self.player = player
         self.ships = ships
-
-    def __getattr__(self, attrname):
-        return getattr(self.player, attrname)
+        # copied from player, they are read on every shot
+        self.uid = player.uid
+        self.name = player.name
 
     def __str__(self):
         return unicode(self).encode('utf-8')
@@ -38,10 +42,12 @@ class Player(object):
     RoboBattleship Player class which holds information about player
     """
 
+    __slots__ = ('name', 'uid', 'secret')
+
     def __init__(self, name, uid=None, secret=None):
         self.name = name
         self.uid = uid or self.generate_uid(name)
-        self.secret = secret or self.generate_secret(name)
+        self.secret = secret or self.generate_secret(self.uid)
 
     def to_dict(self):
         """
@@ -55,13 +61,11 @@ class Player(object):
         """
         return "uid-{uid}".format(uid=hashlib.sha1(name.encode("utf-8")).hexdigest()[:8])
 
-    def generate_secret(self, name):
+    def generate_secret(self, uid):
         """
-        Generates random player secret
+        Generates player secret: a signed token with player uid
         """
-        # FIXME: non-secure algorithm, this is a temporary solution for easier
-        #        debugging only. Make this value random.
-        return "usec-{sec}".format(sec=hashlib.sha1(name.encode("utf-8")).hexdigest()[10:18])
+        return issue_token(uid)
 
     def __str__(self):
         return unicode(self).encode('utf-8')
@@ -6,12 +6,54 @@ Main module of RoboBattleship client players implementations.
 from __future__ import print_function
 from __future__ import unicode_literals
 
-import time
+import json
+import random
+import socket
+from collections import deque
 from threading import Thread
 
 import requests
 
-from robobattleship.settings import HOST, PORT
+from robobattleship.settings import HOST, PORT, STREAM_MAX_EVENTS
+
+
+# Shot results and error codes after which battle with an opponent is over
+# (209: there is no active battle to wait for)
+BATTLE_OVER = ('win', 204, 209, 303, 304)
+
+
+class Opponent(object):
+    """
+    State of a battle with a single opponent as a bot sees it: shots made,
+    cells which are not shot yet, whose turn it is and whether battle is
+    over.
+    """
+
+    def __init__(self, uid, rng=random):
+        self.uid = uid
+        self.finished = False
+        # True if bot knows that it's its turn to shoot
+        self.turn = False
+        # (x, y) -> shot result
+        self.shots = {}
+        # cells which are not shot yet, in the order bot shoots them
+        self.cells = [(x, y) for x in range(10) for y in range(10)]
+        rng.shuffle(self.cells)
+
+    def next_cell(self):
+        "Returns next cell to shoot at or None if all cells are shot"
+        return self.cells[-1] if self.cells else None
+
+    def record(self, x, y, result):
+        "Updates state with a result of a shot at x,y"
+        if result in ('miss', 'hit', 'touchdown', 'win'):
+            self.shots[(x, y)] = result
+            if (x, y) in self.cells:
+                self.cells.remove((x, y))
+        # bot keeps its turn only after hitting a ship
+        self.turn = result in ('hit', 'touchdown')
+        if result in BATTLE_OVER:
+            self.finished = True
 
 
 class Bot(Thread):
@@ -19,7 +61,8 @@ class Bot(Thread):
     A base class for all bot implementations
     """
 
-    def __init__(self, server_url=None, name="Bot", uid=None, secret=None):
+    def __init__(self, server_url=None, name="Bot", uid=None, secret=None,
+                 stream_address=None, seed=None):
         super(Bot, self).__init__()
 
         self.url = server_url or "http://%s:%s/" % (HOST, PORT)
@@ -27,9 +70,23 @@ class Bot(Thread):
         self.uid = uid
         self.secret = secret
 
+        # (host, port) of persistent connection server, if it is given bot
+        # sends all commands after registration through a single connection
+        self.stream_address = stream_address
+        self.stream = None
+        self.stream_buffer = b""
+        # events received through persistent connection
+        self.events = deque(maxlen=STREAM_MAX_EVENTS)
+        # opponent uid -> Opponent, battles bot is fighting
+        self.opponents = {}
+        # all random choices of the bot are made with it, so a bot with the
+        # same seed plays the same way
+        self.random = random.Random(seed)
+
     def run(self):
-        time.sleep(2)
         self.register()
+        if self.stream_address:
+            self.connect()
         self.setships(self.getships())
         self.fight_loop()
 
@@ -62,6 +119,9 @@ class Bot(Thread):
         """
         Sets player's ships on the server
         """
+        if self.stream is not None:
+            self._command("SETSHIPS", ships)
+            return
         self._get("{url}setships/{uid}/{secret}/{ships}".format(url=self.url,
             uid=self.uid, secret=self.secret, ships=ships))
 
@@ -69,15 +129,162 @@ class Bot(Thread):
         """
         Shoot opponent at x,y coordinates
         """
-        response = self._get("{url}shoot/{uid}/{secret}/{opponent}/{x}/{y}" \
-            .format(url=self.url, uid=self.uid, secret=self.secret,
-                opponent=opponent, x=x, y=y))
+        if self.stream is not None:
+            response = self._command("SHOOT", opponent, x, y)
+        else:
+            response = self._get("{url}shoot/{uid}/{secret}/{opponent}/{x}/{y}" \
+                .format(url=self.url, uid=self.uid, secret=self.secret,
+                    opponent=opponent, x=x, y=y))
         if response.get('status') == 'success':
-            return response.get('result')
+            result = response.get('result')
         elif response.get('status') == 'fail':
-            return response.get('error').get('code')
+            result = response.get('error').get('code')
+        else:
+            result = 'fail'
+        if opponent in self.opponents:
+            self.opponents[opponent].record(x, y, result)
+        return result
+
+    def wait_turn(self, opponent):
+        """
+        Waits until it's bot's turn to shoot at opponent. Returns True if bot
+        can shoot, False if it has to wait more or an error code.
+        """
+        if self.stream is not None:
+            response = self._command("WAIT", opponent)
+        else:
+            response = self._get("{url}wait_turn/{uid}/{secret}/{opponent}" \
+                .format(url=self.url, uid=self.uid, secret=self.secret,
+                    opponent=opponent))
+        if response.get('status') == 'success':
+            turn = response.get('turn')
+        elif response.get('status') == 'fail':
+            turn = response.get('error').get('code')
+        else:
+            turn = 'fail'
+        state = self.opponents.get(opponent)
+        if state is not None:
+            state.turn = turn is True
+            if turn in BATTLE_OVER:
+                state.finished = True
+        return turn
+
+    def fire(self, opponent):
+        """
+        Shoots opponent at the next cell which wasn't shot yet and drops
+        the opponent once battle is over. Returns shot result.
+        """
+        state = self.opponents[opponent]
+        cell = state.next_cell()
+        if cell is None:
+            self.drop_opponent(opponent)
+            return None
+        result = self.shoot(opponent, *cell)
+        if state.finished:
+            self.drop_opponent(opponent)
+        return result
+
+    def add_opponent(self, uid):
+        """
+        Starts tracking a battle with opponent with given uid. A new battle
+        with the same opponent starts with fresh state.
+        """
+        if uid != self.uid and uid not in self.opponents:
+            self.opponents[uid] = Opponent(uid, self.random)
+
+    def drop_opponent(self, uid):
+        "Stops tracking a battle with opponent with given uid"
+        self.opponents.pop(uid, None)
+
+    def match(self):
+        """
+        Asks server to find an opponent. Returns a tuple (opponent uid, bid)
+        once bot is paired with somebody, returns None while bot is waiting.
+        """
+        if self.stream is not None:
+            response = self._command("MATCH")
         else:
-            return 'fail'
+            response = self._get("{url}match/{uid}/{secret}".format(
+                url=self.url, uid=self.uid, secret=self.secret))
+        if response.get('status') == 'success' and response.get('opponent'):
+            return response.get('opponent'), response.get('bid')
+        return None
+
+    def connect(self):
+        """
+        Opens a persistent connection to the server and authenticates.
+        """
+        self.stream = socket.create_connection(self.stream_address)
+        self.stream_buffer = b""
+        response = self._command("AUTH", self.uid, self.secret)
+        if response.get('status') != 'success':
+            self.disconnect()
+
+    def disconnect(self):
+        "Closes persistent connection to the server"
+        if self.stream is None:
+            return
+        try:
+            self.stream.sendall(b"QUIT\n")
+        except socket.error:
+            pass
+        self.stream.close()
+        self.stream = None
+
+    def wait_event(self, timeout=None):
+        """
+        Returns next event sent by server through persistent connection.
+        Returns None if no event arrived in timeout seconds.
+        """
+        if self.events:
+            return self.events.popleft()
+        if self.stream is None:
+            return None
+        packet = self._readline(timeout)
+        if packet is not None and "event" not in packet:
+            return None
+        return packet
+
+    def _command(self, *args):
+        """
+        Sends command through persistent connection and returns parsed
+        response. Events which arrive before the response are queued.
+        """
+        line = " ".join("%s" % arg for arg in args) + "\n"
+        try:
+            self.stream.sendall(line.encode("utf-8"))
+            while True:
+                packet = self._readline()
+                if packet is None:
+                    return {}
+                if "event" in packet:
+                    self.events.append(packet)
+                    continue
+                return packet
+        except socket.error:
+            self.disconnect()
+            return {}
+
+    def _readline(self, timeout=None):
+        """
+        Reads a line from persistent connection and returns parsed JSON
+        packet. Returns None on timeout or if connection was closed.
+        """
+        while b"\n" not in self.stream_buffer:
+            self.stream.settimeout(timeout)
+            try:
+                data = self.stream.recv(4096)
+            except socket.timeout:
+                return None
+            finally:
+                if self.stream is not None:
+                    self.stream.settimeout(None)
+            if not data:
+                self.disconnect()
+                return None
+            self.stream_buffer += data
+        line, self.stream_buffer = self.stream_buffer.split(b"\n", 1)
+        return json.loads(line.decode("utf-8"))
 
     def _get(self, url):
         """
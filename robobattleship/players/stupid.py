@@ -7,9 +7,8 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import time
-import random
 
-from robobattleship.players import Bot
+from robobattleship.players import Bot, BATTLE_OVER
 
 
 SHIPS1 = ("1000100001"
@@ -73,38 +72,48 @@ class StupidBot(Bot):
     """
 
     def __init__(self,server_url=None, name="Bot", uid=None, secret=None,
-                 opponents=None):
-        super(StupidBot, self).__init__(server_url, name, uid, secret)
+                 opponents=None, stream_address=None, seed=None):
+        super(StupidBot, self).__init__(server_url, name, uid, secret,
+                                        stream_address, seed)
 
-        self.opponents = opponents or []
+        for uid in opponents or []:
+            self.add_opponent(uid)
         self.stop_fight_flag = False
 
     def getships(self):
-        return random.choice([SHIPS1, SHIPS2, SHIPS3, SHIPS4, SHIPS5])
+        return self.random.choice([SHIPS1, SHIPS2, SHIPS3, SHIPS4, SHIPS5])
 
     def fight_loop(self):
         """
-        Infinite loop in which player shoots everyone he knows about, then
-        sleeps for 0.25 sec and starts over
+        Infinite loop in which player waits for his turn and shoots
+        everyone he fights with. Player without opponents asks server to
+        find one.
         """
         while True:
             if self.stop_fight_flag:
                 break
 
             if not self.opponents:
-                time.sleep(5)
+                found = self.match()
+                if found:
+                    self.add_opponent(found[0])
+                else:
+                    time.sleep(1)
                 continue
 
-            for opponent in self.opponents:
-                self.shoot(opponent, random.randrange(10),
-                                     random.randrange(10))
-
-            time.sleep(0.25)
-
-    def add_opponent(self, uid):
-        "Adds an opponent to opponents list of a bot"
-        if self.uid != uid:
-            self.opponents.append(uid)
+            for opponent in list(self.opponents):
+                state = self.opponents.get(opponent)
+                if state is not None and state.turn:
+                    # still bot's turn after a hit, no need to ask server
+                    self.fire(opponent)
+                    continue
+                turn = self.wait_turn(opponent)
+                if turn is True:
+                    self.fire(opponent)
+                elif turn in BATTLE_OVER:
+                    self.drop_opponent(opponent)
+                elif turn == 'fail':
+                    time.sleep(1)
 
     def stop_fight(self):
         "Tells bot to stop fighting"
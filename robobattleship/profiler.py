@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103
+"""
+This module contains an on-demand profiler which can be turned on for a
+short period of time on a running server.
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import time
+import pstats
+import cProfile
+import functools
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+import robobattleship.log
+from robobattleship.errors import RoboBattleshipException
+from robobattleship.settings import PROFILE_TOP
+
+LOG = robobattleship.log.getLogger(__name__)
+
+
+class Profiler(object):
+    """
+    Profiler which collects cProfile statistics of the whole process and
+    timings of named hot path sections while it is running.
+
+    When profiler is off the only overhead of a profiled section is a check
+    of a single attribute.
+    """
+
+    def __init__(self):
+        self.active = False
+        self.profile = None
+        self.sections = {}
+
+    def start(self):
+        "Starts profiling"
+        if self.active:
+            raise RoboBattleshipException(103)
+        LOG.info("Starting profiler")
+        self.sections = {}
+        self.profile = cProfile.Profile()
+        self.active = True
+        # all greenlets run in a single thread, so this profiles all of them
+        self.profile.enable()
+
+    def stop(self):
+        "Stops profiling and returns a report"
+        self.profile.disable()
+        self.active = False
+        LOG.info("Profiler stopped")
+        return self.report()
+
+    def run(self, seconds):
+        """
+        Profiles server for given number of seconds and returns a report.
+        """
+        self.start()
+        try:
+            time.sleep(seconds)
+        finally:
+            report = self.stop()
+        return report
+
+    def track(self, name, seconds):
+        "Adds execution time of a section to the statistics"
+        section = self.sections.get(name)
+        if section is None:
+            section = self.sections[name] = {"count": 0, "total": 0.0,
+                                             "max": 0.0}
+        section["count"] += 1
+        section["total"] += seconds
+        section["max"] = max(section["max"], seconds)
+
+    def report(self):
+        """
+        Returns profiling report: timings of hot path sections (in
+        milliseconds) and top functions by cumulative time.
+        """
+        stream = StringIO()
+        stats = pstats.Stats(self.profile, stream=stream)
+        stats.sort_stats("cumulative").print_stats(PROFILE_TOP)
+
+        return {
+            "sections": dict((name, {
+                "count": s["count"],
+                "total": round(s["total"] * 1000, 3),
+                "avg": round(s["total"] * 1000 / s["count"], 3),
+                "max": round(s["max"] * 1000, 3),
+            }) for name, s in self.sections.items()),
+            "functions": [line for line in stream.getvalue().splitlines()
+                          if line.strip()],
+        }
+
+
+PROFILER = Profiler()
+
+
+def profiled(name):
+    """
+    Decorator: tracks execution time of a function as a hot path section
+    with given name while profiler is running.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not PROFILER.active:
+                return func(*args, **kwargs)
+            started = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                PROFILER.track(name, time.time() - started)
+        return wrapper
+    return decorator
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103
+"""
+This module contains a shared Jinja environment which loads and compiles
+templates once and keeps render time statistics for every template.
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import time
+
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
+
+import robobattleship.log
+from robobattleship.assets import static_url, load_urls
+from robobattleship.profiler import profiled
+from robobattleship.settings import TEMPLATES_ROOT, TEMPLATES_CACHE_ROOT
+
+LOG = robobattleship.log.getLogger(__name__)
+
+
+# Shared environment: compiled templates are kept in memory and compiled
+# bytecode is stored on disk so restarts don't need to recompile them
+ENVIRONMENT = Environment(
+    loader=FileSystemLoader(TEMPLATES_ROOT),
+    bytecode_cache=FileSystemBytecodeCache(TEMPLATES_CACHE_ROOT),
+    autoescape=True,
+    auto_reload=False,
+    cache_size=-1)
+ENVIRONMENT.globals["static_url"] = static_url
+
+# Render time statistics, template name -> stats dict
+STATS = {}
+
+
+def warmup():
+    """
+    Loads and compiles all templates from templates directory and hashes
+    static files they link to, so first requests after a server start
+    don't have to do it.
+    """
+    started = time.time()
+    LOG.info("Hashed %s static files", load_urls())
+    names = ENVIRONMENT.list_templates(extensions=["html"])
+    for name in names:
+        ENVIRONMENT.get_template(name)
+    LOG.info("Warmed up %s templates in %.3f sec", len(names),
+        time.time() - started)
+    return names
+
+
+@profiled("render")
+def render(name, **context):
+    """
+    Renders template with given name and context and returns a string.
+    """
+    template = ENVIRONMENT.get_template(name)
+    started = time.time()
+    try:
+        return template.render(**context)
+    finally:
+        track(name, time.time() - started)
+
+
+def track(name, seconds):
+    "Adds render time of a template to the statistics"
+    stats = STATS.get(name)
+    if stats is None:
+        stats = STATS[name] = {"count": 0, "total": 0.0, "max": 0.0}
+    stats["count"] += 1
+    stats["total"] += seconds
+    stats["max"] = max(stats["max"], seconds)
+
+
+def stats():
+    """
+    Returns render time statistics for every rendered template (in
+    milliseconds).
+    """
+    return dict((name, {
+        "count": s["count"],
+        "avg": round(s["total"] * 1000 / s["count"], 3),
+        "max": round(s["max"] * 1000, 3),
+    }) for name, s in STATS.items() if s["count"])
+
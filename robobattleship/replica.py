@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103
+"""
+This module contains read-only spectator replica of RoboBattleship Server.
+
+Replica subscribes to state change events of the primary server (see
+robobattleship.replication), applies them to its own server instance and
+serves only viewing routes, so spectators don't load the primary:
+
+    $ python robobattleship --replica
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import time
+import socket
+
+import robobattleship.log
+from robobattleship.player import Player
+from robobattleship.server import Server
+from robobattleship.replication import battle_from_event
+from robobattleship.settings import (REPLICATION_HOST, REPLICATION_PORT,
+    REPLICATION_HEARTBEAT, REPLICA_RECONNECT_DELAY)
+
+LOG = robobattleship.log.getLogger(__name__)
+
+
+class Replica(object):
+    """
+    Follows event stream of the primary server. Every connection starts
+    from a snapshot into a fresh server instance, which replaces the served
+    one once it is synced; until then spectators see the previous state.
+    """
+
+    def __init__(self, context, address=(REPLICATION_HOST, REPLICATION_PORT)):
+        self.context = context
+        self.address = address
+        self.running = False
+        self.synced = False
+        # number of applied events and time of the last received one
+        self.applied = 0
+        self.last_event = None
+        # number of events which didn't apply the same way as on the primary
+        # or failed to apply
+        self.diverged = 0
+
+    def run(self):
+        "Infinite loop which follows the primary and reconnects to it"
+        self.running = True
+        while self.running:
+            try:
+                self.follow()
+            except:
+                LOG.exception("Lost connection to primary %s", self.address)
+            self.synced = False
+            time.sleep(REPLICA_RECONNECT_DELAY)
+
+    def stop(self):
+        "Stops following the primary"
+        self.running = False
+
+    def follow(self):
+        "Applies events from a single connection to the primary"
+        sock = socket.create_connection(self.address)
+        # primary sends pings, so silence means it is gone
+        sock.settimeout(REPLICATION_HEARTBEAT * 3)
+        LOG.info("Following primary %s", self.address)
+        server = Server()
+        buf = b""
+        try:
+            while self.running:
+                data = sock.recv(65536)
+                if not data:
+                    return
+                buf += data
+                lines = buf.split(b"\n")
+                buf = lines.pop()
+                for line in lines:
+                    self.apply(server, json.loads(line.decode("utf-8")))
+        finally:
+            sock.close()
+
+    def apply(self, server, packet):
+        "Applies a single event to given server"
+        self.last_event = time.time()
+        event = packet.pop("event")
+        handler = getattr(self, "apply_" + event, None)
+        if handler is None:
+            return
+        # a broken event must not cost a reconnect and a full snapshot
+        try:
+            handler(server, **packet)
+        except:
+            self.diverged += 1
+            LOG.exception("Failed to apply '%s' event", event)
+        self.applied += 1
+
+    def apply_register(self, server, uid, name):
+        "Registers a player, replica doesn't know player secrets"
+        with server.lock:
+            server.players[uid] = Player(name, uid=uid)
+
+    def apply_setships(self, server, uid, ships):
+        "Sets ships arrangement of a player"
+        server.setships(uid, ships)
+
+    def apply_battle(self, server, archived=False, **data):
+        "Adds an active or archived battle"
+        battle = battle_from_event(data, server.players)
+        with server.lock:
+            if archived:
+                server.archived_battles[battle.bid] = battle
+            else:
+                server.battles[battle.bid] = battle
+
+    def apply_last_archived(self, server, bid, archived_bid):
+        "Makes an archived battle available by its old bid"
+        with server.lock:
+            server.last_archived_battles[bid] = \
+                server.archived_battles[archived_bid]
+
+    def apply_shot(self, server, bid, n, uid, x, y, result, shottime):
+        """
+        Repeats a shot. Shots which are already in the shot log (sent both
+        in a snapshot and live) are skipped.
+        """
+        battle = server.battles.get(bid)
+        if battle is None or len(battle.shots) >= n:
+            return
+        if battle.shoot(uid, x, y) != result:
+            self.diverged += 1
+            LOG.error("Shot %s of battle '%s' diverged from primary", n, bid)
+        # keep the time of the shot on the primary
+        battle.shots[-1] = (shottime,) + battle.shots[-1][1:]
+        if result == 'win':
+            battle.finished = shottime
+
+    def apply_forfeit(self, server, bid, uid, finished):
+        """
+        Player gives up the battle. Battle might be already forfeited in a
+        snapshot which was taken after the forfeit.
+        """
+        battle = server.get_active_battle(bid)
+        if not battle.is_active():
+            return
+        battle.forfeit(uid)
+        battle.finished = finished
+
+    def apply_archive(self, server, bid, archived_bid):
+        "Moves active battle into archive"
+        battle = server.get_active_battle(bid)
+        server.archive_battle(battle.player1.uid, battle.player2.uid,
+                              archived_bid)
+
+    def apply_ratings(self, server, ratings):
+        "Sets ratings of all players"
+        with server.lock:
+            server.ratings.update(ratings)
+
+    def apply_synced(self, server):
+        "Snapshot is applied, starts serving the new server"
+        self.context.server = server
+        self.context.state_restored = True
+        self.synced = True
+        LOG.info("Synced with primary %s: %s", self.address, server)
+
+    def stats(self):
+        "Returns replication status"
+        return {
+            "synced": self.synced,
+            "applied": self.applied,
+            "diverged": self.diverged,
+            "silence": (round(time.time() - self.last_event, 3)
+                        if self.last_event else None),
+        }
+
+
+def main():
+    """
+    Runs read-only spectator replica web server.
+    """
+    import gevent
+    from gevent.pywsgi import WSGIServer
+    from robobattleship.app import CONTEXT, create_app, warmup
+    from robobattleship.admission import AdmissionControl
+    from robobattleship.settings import HOST, REPLICA_PORT
+
+    app = create_app(readonly=True)
+    CONTEXT.admission = AdmissionControl(app)
+    CONTEXT.replication = Replica(CONTEXT)
+    webserver = WSGIServer((HOST, REPLICA_PORT), CONTEXT.admission)
+
+    LOG.info("Starting RoboBattleship replica on {host}:{port}"
+        .format(host=HOST, port=REPLICA_PORT))
+    webserver.start()
+
+    gevent.spawn(warmup)
+    gevent.spawn(CONTEXT.replication.run)
+    try:
+        webserver.serve_forever()
+    finally:
+        CONTEXT.replication.stop()
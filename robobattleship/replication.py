@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103
+"""
+This module contains replication of game state to read-only replicas.
+
+Primary server publishes an event for every state change to subscribed
+replicas, one JSON object per line:
+
+    {"event": "register", "uid": "<uid>", "name": "<name>"}
+    {"event": "setships", "uid": "<uid>", "ships": "<ships>"}
+    {"event": "battle", "bid": "<bid>", "players": [...], "shooter": ...}
+    {"event": "shot", "bid": "<bid>", "n": 1, "uid": "<uid>", "x": 0, ...}
+    {"event": "forfeit", "bid": "<bid>", "uid": "<uid>", "finished": ...}
+    {"event": "archive", "bid": "<bid>", "archived_bid": "<bid>"}
+
+A new subscriber first gets a snapshot of the whole state as events
+(including "last_archived" and "ratings"), followed by "synced" event.
+Snapshot events are made while they are sent, so the primary never holds
+a serialized copy of its state. A
+"ping" event is sent when there is nothing else to send.
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import socket
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import robobattleship.log
+from robobattleship.battle import Battle
+from robobattleship.player import PlayerWithShips
+from robobattleship.export import battle_to_dict
+from robobattleship.settings import (REPLICATION_OUTBOX_SIZE,
+    REPLICATION_HEARTBEAT)
+
+LOG = robobattleship.log.getLogger(__name__)
+
+
+def battle_event(battle, archived=False):
+    """
+    Returns data of event which recreates given battle on a replica.
+    """
+    data = battle_to_dict(battle)
+    data["shooter"] = battle.shooter.uid
+    data["archived"] = archived
+    return data
+
+
+def battle_from_event(data, players):
+    """
+    Creates a battle from data of a battle event. Players are looked up in
+    given uid -> player dictionary.
+    """
+    player1, player2 = [
+        PlayerWithShips(players[p["uid"]], [list(row) for row in p["ships"]])
+        for p in data["players"]]
+    return Battle(player1, player2, bid=data["bid"],
+                  shooter_uid=data["shooter"], winner_uid=data["winner"],
+                  created=data["created"], finished=data["finished"],
+                  seed=data.get("seed"),
+                  shots=[(s["time"], s["uid"], s["x"], s["y"], s["result"])
+                         for s in data["shots"]])
+
+
+def shot_event(battle):
+    "Returns data of event with the last shot of given battle"
+    shottime, uid, x, y, result = battle.shots[-1]
+    return {"bid": battle.bid, "n": len(battle.shots), "uid": uid, "x": x,
+            "y": y, "result": result, "shottime": shottime}
+
+
+def encode(event, data):
+    "Returns event as a line of JSON"
+    packet = {"event": event}
+    packet.update(data)
+    return (json.dumps(packet) + "\n").encode("utf-8")
+
+
+def capture(server):
+    """
+    Returns references to the current state of the server which a snapshot
+    is made of. Must be called with server lock held; nothing is serialized
+    here, so the lock is held only briefly.
+    """
+    return {
+        "players": list(server.players.values()),
+        "ships": list(server.ships.items()),
+        "archived": list(server.archived_battles.values()),
+        "last_archived": [(bid, battle.bid) for bid, battle
+                          in server.last_archived_battles.items()],
+        # battle gets a new bid when archived, so bids are captured too
+        "battles": list(server.battles.items()),
+        "ratings": dict(server.ratings),
+    }
+
+
+def snapshot(state):
+    """
+    Yields (event, data) tuples which recreate captured state of the server.
+    Changes made after the state was captured are published as live events:
+    every battle is read with its lock held, so its later shots are not
+    lost (replicas skip shots which are both in the snapshot and live).
+    """
+    for player in state["players"]:
+        yield "register", {"uid": player.uid, "name": player.name}
+    for uid, ships in state["ships"]:
+        yield "setships", {"uid": uid,
+                           "ships": "".join("".join(row) for row in ships)}
+
+    archived = sorted(state["archived"], key=lambda b: b.finished or b.created)
+    for battle in archived:
+        with battle.lock:
+            data = battle_event(battle, archived=True)
+        yield "battle", data
+    for bid, archived_bid in state["last_archived"]:
+        yield "last_archived", {"bid": bid, "archived_bid": archived_bid}
+    for bid, battle in state["battles"]:
+        with battle.lock:
+            data = battle_event(battle)
+        # battle might be archived since, it is moved by a live event
+        data["bid"] = bid
+        yield "battle", data
+
+    yield "ratings", {"ratings": state["ratings"]}
+    yield "synced", {}
+
+
+class Publisher(object):
+    """
+    Connection handler for gevent StreamServer which sends state change
+    events of the server to subscribed replicas.
+    """
+
+    def __init__(self, context):
+        self.context = context
+        self.lock = threading.Lock()
+        self.subscribers = []
+        # number of replicas dropped because they didn't keep up
+        self.dropped = 0
+
+    def __call__(self, sock, address):
+        subscriber = Subscriber(sock, address)
+        server = self.context.server
+        with server.lock:
+            with self.lock:
+                self.subscribers.append(subscriber)
+            state = capture(server)
+        LOG.info("Replica %s subscribed, sending snapshot", address)
+        try:
+            subscriber.serve(snapshot(state))
+        finally:
+            self.unsubscribe(subscriber)
+            LOG.info("Replica %s unsubscribed", address)
+
+    def publish(self, event, data):
+        "Sends event to all subscribed replicas"
+        with self.lock:
+            if not self.subscribers:
+                return
+            subscribers = list(self.subscribers)
+        line = encode(event, data)
+        for subscriber in subscribers:
+            if not subscriber.send(line):
+                LOG.warning("Replica %s doesn't keep up, dropping it",
+                    subscriber.address)
+                self.dropped += 1
+                self.unsubscribe(subscriber)
+
+    def unsubscribe(self, subscriber):
+        "Stops sending events to a subscriber"
+        subscriber.closed = True
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+
+    def stats(self):
+        "Returns number of subscribed and dropped replicas"
+        with self.lock:
+            return {
+                "subscribers": len(self.subscribers),
+                "queued": sum(s.outbox.qsize() for s in self.subscribers),
+                "dropped": self.dropped,
+            }
+
+
+class Subscriber(object):
+    """
+    A single replica connection: live events waiting to be sent after the
+    snapshot.
+    """
+
+    def __init__(self, sock, address):
+        self.socket = sock
+        self.address = address
+        self.closed = False
+        self.outbox = queue.Queue(REPLICATION_OUTBOX_SIZE)
+
+    def send(self, line):
+        """
+        Queues event line to be sent. Returns False if replica doesn't keep
+        up and its queue is full.
+        """
+        try:
+            self.outbox.put_nowait(line)
+            return True
+        except queue.Full:
+            return False
+
+    def serve(self, events):
+        """
+        Writes given snapshot events as they are made, then queued live
+        events until replica disconnects or is dropped.
+        """
+        try:
+            for event, data in events:
+                if self.closed:
+                    return
+                self.socket.sendall(encode(event, data))
+
+            while not self.closed:
+                try:
+                    line = self.outbox.get(timeout=REPLICATION_HEARTBEAT)
+                except queue.Empty:
+                    line = encode("ping", {})
+                self.socket.sendall(line)
+        except socket.error:
+            pass
+        finally:
+            self.socket.close()
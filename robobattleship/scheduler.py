@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103
+"""
+This module contains a hashed timer wheel which is used to expire stalled
+battles.
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import time
+import threading
+
+import robobattleship.log
+from robobattleship.settings import TIMER_WHEEL_SLOTS, TIMER_WHEEL_TICK
+
+LOG = robobattleship.log.getLogger(__name__)
+
+
+class TimerWheel(object):
+    """
+    Hashed timer wheel. Scheduling, rescheduling and cancelling a timer are
+    O(1) operations, every tick only looks at a single slot of the wheel.
+
+    Timers are identified by keys (e.g. battle ids), scheduling a timer for
+    a key which already has one replaces the old timer.
+    """
+
+    def __init__(self, slots=TIMER_WHEEL_SLOTS, tick=TIMER_WHEEL_TICK):
+        self.tick = tick
+        self.position = 0
+        self.running = False
+        # every slot maps timer key to number of full wheel rotations left
+        self.slots = [{} for _ in range(slots)]
+        # timer key -> slot index
+        self.timers = {}
+        self.lock = threading.Lock()
+
+    def schedule(self, key, timeout):
+        """
+        Schedules timer with given key to expire in given number of seconds.
+        """
+        ticks = max(1, int(-(-timeout // self.tick)))
+        with self.lock:
+            self._cancel(key)
+            slot = (self.position + ticks) % len(self.slots)
+            self.slots[slot][key] = (ticks - 1) // len(self.slots)
+            self.timers[key] = slot
+
+    def cancel(self, key):
+        "Cancels timer with given key (if any)"
+        with self.lock:
+            self._cancel(key)
+
+    def _cancel(self, key):
+        "Cancels timer without locking"
+        slot = self.timers.pop(key, None)
+        if slot is not None:
+            del self.slots[slot][key]
+
+    def advance(self):
+        """
+        Moves the wheel one tick forward and returns a list of keys of
+        expired timers.
+        """
+        with self.lock:
+            self.position = (self.position + 1) % len(self.slots)
+            bucket = self.slots[self.position]
+            expired = []
+            for key, rounds in list(bucket.items()):
+                if rounds:
+                    bucket[key] = rounds - 1
+                else:
+                    del bucket[key]
+                    del self.timers[key]
+                    expired.append(key)
+        return expired
+
+    def run(self, callback):
+        """
+        Infinite loop which advances the wheel every tick and calls callback
+        with a key of every expired timer. Sleeps between ticks, so it plays
+        well with gevent.
+        """
+        self.running = True
+        while self.running:
+            time.sleep(self.tick)
+            for key in self.advance():
+                try:
+                    callback(key)
+                except:
+                    LOG.exception("Failed to process expired timer '%s'", key)
+
+    def stop(self):
+        "Stops timer wheel loop"
+        self.running = False
+
+    def __len__(self):
+        return len(self.timers)
@@ -9,14 +9,23 @@ from __future__ import unicode_literals
 import os
 import re
 import copy
+import random
 import textwrap
+import threading
 from datetime import datetime
 
 import robobattleship.log
 from robobattleship.player import Player, PlayerWithShips
 from robobattleship.battle import Battle
+from robobattleship.auth import is_token, verify_token
+from robobattleship.utils import constant_time_compare
+from robobattleship.scheduler import TimerWheel
+from robobattleship.profiler import profiled
+from robobattleship.matchmaking import Matchmaker
+from robobattleship.replication import battle_event, shot_event
 from robobattleship.errors import ValidationException, BattleException
-from robobattleship.settings import DUMPS_ROOT
+from robobattleship.settings import (DUMPS_ROOT, TURN_TIMEOUT, RATING_DEFAULT,
+    RATING_K)
 
 LOG = robobattleship.log.getLogger(__name__)
 
@@ -28,12 +37,44 @@ class Server(object):
     """
 
     def __init__(self, players=None, ships=None, battles=None,
-        archived_battles=None, last_archived_battles=None):
+        archived_battles=None, last_archived_battles=None, ratings=None,
+        seed=None):
         self.players = players or {}
         self.ships = ships or {}
         self.battles = battles or {}
         self.archived_battles = archived_battles or {}
         self.last_archived_battles = last_archived_battles or {}
+        self.ratings = ratings or {}
+
+        # seeds of new battles are drawn from it, so the same seed gives the
+        # same sequence of battles
+        self.random = random.Random(seed)
+
+        # guards all server state, every battle has its own lock as well
+        self.lock = threading.RLock()
+
+        # players waiting for an opponent
+        self.matchmaker = Matchmaker()
+        # uid -> (opponent uid, bid) of matches the player wasn't told about
+        self.matches = {}
+        # uid -> list of callbacks called when it's player's turn to shoot
+        self.turn_listeners = {}
+
+        # receives state change events for replicas (see
+        # robobattleship.replication)
+        self.publisher = None
+
+        # timers of last activity in active battles
+        self.expiry = TimerWheel()
+        for bid in self.battles:
+            self.expiry.schedule(bid, TURN_TIMEOUT)
+
+        # battles which were won right before the state was dumped, but
+        # weren't archived yet
+        for battle in list(self.battles.values()):
+            if not battle.is_active():
+                self.archive_battle(battle.player1.uid, battle.player2.uid)
+
         LOG.info("Initializing the RoboBattleship Server with %s "
             "players and %s battles", self.total_players(), self.total_battles())
 
@@ -50,14 +91,15 @@ class Server(object):
             raise ValidationException(213, maxlength=50)
         if len(name) < 2:
             raise ValidationException(214, minlength=2)
-        if self.is_player_registered(name=name):
-            raise ValidationException(203, name=name)
+        with self.lock:
+            if self.is_player_registered(name=name):
+                raise ValidationException(203, name=name)
 
-        player = Player(name)
+            player = Player(name)
+            self.players[player.uid] = player
+            self.publish("register", uid=player.uid, name=player.name)
 
         LOG.info("Registering [%s]", player)
-
-        self.players[player.uid] = player
         return player
 
     def validate_player(self, uid, secret):
@@ -71,11 +113,19 @@ class Server(object):
             raise ValidationException(205)
         if not secret:
             raise ValidationException(206)
+
+        # signed token is verified without looking up the player, other
+        # secrets (e.g. restored from old dumps) are compared with the stored
+        # one
+        if is_token(secret) and verify_token(uid, secret):
+            return
+
         if not self.is_player_registered(uid=uid):
             raise ValidationException(204, uid=uid)
-        if self.get_player(uid).secret != secret:
+        if not constant_time_compare(self.get_player(uid).secret, secret):
             raise ValidationException(207, uid=uid)
 
+    @profiled("Server.shoot")
     def shoot(self, p1uid, p2uid, x, y):
         """
         Player with given p1uid shoots at player with p2uid at [x,y]
@@ -93,13 +143,75 @@ class Server(object):
         if not (0 <= x <= 9) or not (0 <= y <= 9):
             raise ValidationException(210)
 
-        try:
-            battle = self.get_active_battle(Battle.generate_bid(p1uid, p2uid))
-        except ValidationException:
-            battle = self.create_battle(p1uid, p2uid)
-            self.battles[battle.bid] = battle
+        self.check_finished(p1uid, p2uid)
+        battle = self.get_or_create_battle(p1uid, p2uid)
+        result = battle.shoot(p1uid, x, y, self.publish_shot
+                              if self.publisher is not None else None)
+
+        if result == 'win':
+            with self.lock:
+                battle.notified.add(p1uid)
+                # expiry might have archived the finished battle already
+                if self.battles.get(Battle.generate_bid(p1uid, p2uid)) \
+                        is battle:
+                    self.archive_battle(p1uid, p2uid)
+        else:
+            self.expiry.schedule(battle.bid, TURN_TIMEOUT)
+            if result == 'miss':
+                self.notify_turn(battle)
+
+        return result
+
+    def wait_turn(self, p1uid, p2uid, timeout):
+        """
+        Waits until it's turn of player with given p1uid to shoot at player
+        with p2uid, but no longer than timeout seconds. Returns battle and
+        True if it's player's turn to shoot. Waiting doesn't start a battle,
+        only shooting and matchmaking do.
+        """
+        if not self.is_player_registered(uid=p1uid):
+            raise ValidationException(204, uid=p1uid)
+        if not self.is_player_registered(uid=p2uid):
+            raise ValidationException(204, uid=p2uid)
 
-        return battle.shoot(p1uid, x, y)
+        self.check_finished(p1uid, p2uid)
+        battle = self.get_active_battle(Battle.generate_bid(p1uid, p2uid))
+        return battle, battle.wait_turn(p1uid, timeout)
+
+    def check_finished(self, p1uid, p2uid):
+        """
+        Finished battles are archived right away, so let every player know
+        (once) that his last battle is over before starting a new one.
+        """
+        with self.lock:
+            finished = self.last_archived_battles.get(
+                Battle.generate_bid(p1uid, p2uid))
+            if finished is None or p1uid in finished.notified:
+                return
+            finished.notified.add(p1uid)
+        raise BattleException(304, winner=finished.winner,
+                              looser=finished.looser)
+
+    def match(self, uid):
+        """
+        Puts player with given uid into matchmaking queue. Returns a tuple
+        (opponent uid, bid) once player is paired with an opponent and a
+        battle between them is created, returns None while player is waiting.
+        """
+        with self.lock:
+            if uid in self.matches:
+                return self.matches.pop(uid)
+            if not self.ships.get(uid):
+                raise BattleException(303, uid=uid)
+
+            opponent = self.matchmaker.enqueue(uid, self.get_rating(uid))
+            if opponent is None:
+                return None
+
+            battle = self.get_or_create_battle(uid, opponent)
+            self.matches[opponent] = (uid, battle.bid)
+        LOG.info("Matched [%s] with [%s]", uid, opponent)
+        return opponent, battle.bid
 
     def setships(self, uid, ships):
         """
@@ -111,7 +223,10 @@ class Server(object):
             raise ValidationException(212)
 
         # convert string into matrix
-        self.ships[uid] = [textwrap.wrap(s, 1) for s in textwrap.wrap(ships, 10)]
+        matrix = [textwrap.wrap(s, 1) for s in textwrap.wrap(ships, 10)]
+        with self.lock:
+            self.ships[uid] = matrix
+            self.publish("setships", uid=uid, ships=ships)
 
     def get_player(self, uid):
         """
@@ -141,6 +256,29 @@ class Server(object):
 
         raise ValidationException(209, bid=bid)
 
+    def get_or_create_battle(self, p1uid, p2uid):
+        """
+        Returns active battle between players with given uids, creates a new
+        one if there is no such battle.
+        """
+        bid = Battle.generate_bid(p1uid, p2uid)
+        with self.lock:
+            battle = self.battles.get(bid)
+            if battle is not None:
+                return battle
+            battle = self.create_battle(p1uid, p2uid)
+            self.battles[bid] = battle
+            # players who got a battle without matchmaking aren't available
+            # for it anymore
+            self.matchmaker.cancel(p1uid)
+            self.matchmaker.cancel(p2uid)
+            self.expiry.schedule(bid, TURN_TIMEOUT)
+            if self.publisher is not None:
+                self.publish("battle", **battle_event(battle))
+
+        self.notify_turn(battle)
+        return battle
+
     def create_battle(self, p1uid, p2uid):
         """
         Creates new battle between players with given uids
@@ -156,29 +294,116 @@ class Server(object):
             raise BattleException(303, uid=p2uid)
 
         battle = Battle(PlayerWithShips(p1, copy.deepcopy(p1ships)),
-                        PlayerWithShips(p2, copy.deepcopy(p2ships)))
+                        PlayerWithShips(p2, copy.deepcopy(p2ships)),
+                        seed=self.random.getrandbits(32))
         return battle
 
-    def archive_battle(self, p1uid, p2uid):
+    def archive_battle(self, p1uid, p2uid, newbid=None):
         """
-        Moves active battle into archive.
+        Moves active battle into archive. Archived battle gets given new bid
+        (battle id), by default old bid with a time marker.
         """
         # add time marker to battle id
         oldbid = Battle.generate_bid(p1uid, p2uid)
-        newbid = "{oldbid}_{time}".format(oldbid=oldbid,
+        newbid = newbid or "{oldbid}_{time}".format(oldbid=oldbid,
             time=datetime.now().strftime("%Y.%m.%d_%H.%M.%S"))
 
-        # remove battle from active list
-        battle = self.get_active_battle(oldbid)
-        del self.battles[oldbid]
+        with self.lock:
+            # remove battle from active list
+            battle = self.get_active_battle(oldbid)
+            del self.battles[oldbid]
+            self.expiry.cancel(oldbid)
+
+            # players who weren't told about the match won't play it anymore
+            for uid in (p1uid, p2uid):
+                if self.matches.get(uid, (None, None))[1] == oldbid:
+                    del self.matches[uid]
 
-        # save battle to the last archived list so it will still be available
-        # by old battle id
-        self.last_archived_battles[oldbid] = battle
+            # save battle to the last archived list so it will still be
+            # available by old battle id
+            self.last_archived_battles[oldbid] = battle
 
-        # set new bid and add battle to archive
-        battle.bid = newbid
-        self.archived_battles[newbid] = battle
+            # set new bid and add battle to archive
+            battle.bid = newbid
+            self.archived_battles[newbid] = battle
+            battle.compact()
+            self.publish("archive", bid=oldbid, archived_bid=newbid)
+
+            if battle.winner:
+                self.update_ratings(battle.winner.uid, battle.looser.uid)
+
+    def expire_battle(self, bid):
+        """
+        Ends active battle with given bid (battle id) because current shooter
+        didn't shoot in time: shooter forfeits the battle and it is moved
+        into archive. Battle which is already finished but wasn't archived
+        is just archived.
+        """
+        with self.lock:
+            battle = self.battles.get(bid)
+            if battle is None:
+                return
+            if not battle.is_active():
+                LOG.info("Battle '%s' is finished, archiving it", bid)
+                self.archive_battle(battle.player1.uid, battle.player2.uid)
+                return
+
+            LOG.info("Battle '%s' expired, [%s] forfeits", bid, battle.shooter)
+            uid = battle.shooter.uid
+            battle.forfeit(uid)
+            self.publish("forfeit", bid=bid, uid=uid,
+                         finished=battle.finished)
+            self.archive_battle(battle.player1.uid, battle.player2.uid)
+
+    def add_turn_listener(self, uid, callback):
+        """
+        Registers a callback which is called with opponent uid and battle id
+        every time it's turn of player with given uid to shoot.
+        """
+        with self.lock:
+            self.turn_listeners.setdefault(uid, []).append(callback)
+
+    def remove_turn_listener(self, uid, callback):
+        "Unregisters callback added by add_turn_listener"
+        with self.lock:
+            callbacks = self.turn_listeners.get(uid, [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+            if not callbacks:
+                self.turn_listeners.pop(uid, None)
+
+    def notify_turn(self, battle):
+        "Tells current shooter of given battle that it's his turn to shoot"
+        with battle.lock:
+            shooter, opponent = battle.shooter.uid, battle.opponent.uid
+        with self.lock:
+            callbacks = list(self.turn_listeners.get(shooter, ()))
+        for callback in callbacks:
+            callback(opponent, battle.bid)
+
+    def publish(self, event, **data):
+        "Sends state change event to replicas (if there is a publisher)"
+        if self.publisher is not None:
+            self.publisher.publish(event, data)
+
+    def publish_shot(self, battle):
+        "Sends the last shot of given battle to replicas"
+        self.publish("shot", **shot_event(battle))
+
+    def get_rating(self, uid):
+        "Returns rating of player with given uid"
+        return self.ratings.get(uid, RATING_DEFAULT)
+
+    def update_ratings(self, winner_uid, looser_uid):
+        """
+        Updates Elo ratings of players after battle between them is over.
+        """
+        winner = self.get_rating(winner_uid)
+        looser = self.get_rating(looser_uid)
+        expected = 1.0 / (1 + 10 ** ((looser - winner) / 400.0))
+        change = int(round(RATING_K * (1 - expected)))
+        self.ratings[winner_uid] = winner + change
+        self.ratings[looser_uid] = looser - change
 
     def is_player_registered(self, name=None, uid=None, secret=None):
         """
@@ -202,15 +427,46 @@ class Server(object):
         "Returns total number of battles registered on the server"
         return len(self.battles)
 
+    def stats(self):
+        "Returns sizes of server state structures"
+        return {
+            "players": len(self.players),
+            "ships": len(self.ships),
+            "battles": len(self.battles),
+            "archived_battles": len(self.archived_battles),
+            "last_archived_battles": len(self.last_archived_battles),
+            "ratings": len(self.ratings),
+            "matches": len(self.matches),
+            "matchmaking": len(self.matchmaker),
+            "turn_listeners": len(self.turn_listeners),
+            "timers": len(self.expiry),
+        }
+
     def dumpstate(self, filename=None):
         """
         Service method which dumps surrent state of the server with players,
         battles and stats into a file
         """
+        path = self.dump_path(filename)
+        with self.lock:
+            state = repr(self)
+        self.write_dump(state, path)
+        return path
+
+    def dump_path(self, filename=None):
+        "Returns full path to a dump file with given name"
         dumpfilename = filename or "server_dump_{date}.py" \
             .format(date=datetime.now().strftime("%Y_%m_%d_%H_%M"))
-        with open(os.path.join(DUMPS_ROOT, dumpfilename), "w") as dumpfile:
-            dumpfile.write(repr(self))
+        return os.path.join(DUMPS_ROOT, dumpfilename)
+
+    def write_dump(self, state, path):
+        """
+        Writes server state into a file. File is replaced atomically, so it
+        never contains a partial dump.
+        """
+        with open(path + ".tmp", "w") as dumpfile:
+            dumpfile.write(state)
+        os.rename(path + ".tmp", path)
 
     def __str__(self):
         return unicode(self).encode('utf-8')
@@ -229,9 +485,11 @@ class Server(object):
                 "players={players},\n"
                 "ships={ships},\n"
                 "battles={battles},\n"
-                "archived_battles={archived_battles})"
+                "archived_battles={archived_battles},\n"
+                "ratings={ratings})"
             .format(players=repr(self.players),
                 ships=repr(self.ships),
                 battles=repr(self.battles),
-                archived_battles=repr(self.archived_battles))
+                archived_battles=repr(self.archived_battles),
+                ratings=repr(self.ratings))
         )
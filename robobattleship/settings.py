@@ -7,18 +7,122 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import os
+import binascii
 
 
 # Host and port for web server to listen
 HOST = "0.0.0.0"
 PORT = 9999
 
+# Port for persistent bot connections
+STREAM_PORT = 9998
+
+# Host and port for primary server to publish state change events to
+# read-only replicas (None - don't publish), replicas connect there
+REPLICATION_HOST = "127.0.0.1"
+REPLICATION_PORT = 9997
+
+# Port for read-only replica web server to listen
+REPLICA_PORT = 9996
+
+# Replication: maximum number of events waiting to be sent to a replica
+# (replicas which don't keep up are dropped), number of seconds between
+# pings when there are no events and number of seconds a replica waits
+# before reconnecting to the primary
+REPLICATION_OUTBOX_SIZE = 10000
+REPLICATION_HEARTBEAT = 5
+REPLICA_RECONNECT_DELAY = 1
+
+# Persistent connection limits: maximum length of command line, number of
+# packets waiting to be sent to a bot and number of unread events kept by
+# a bot client
+STREAM_MAX_LINE = 1024
+STREAM_OUTBOX_SIZE = 100
+STREAM_MAX_EVENTS = 100
+
+# Maximum number of seconds a player can wait for his turn in one request
+WAIT_TURN_TIMEOUT = 30
+
+# Admission control: maximum number of requests processed at the same time,
+# part of them reserved for gameplay routes, and maximum number of requests
+# in flight per route group (see robobattleship.admission)
+ADMISSION_MAX_INFLIGHT = 1000
+ADMISSION_GAMEPLAY_RESERVED = 200
+ADMISSION_LIMITS = {
+    "gameplay": 1000,
+    "longpoll": 2000,
+    "pages": 300,
+    "static": 200,
+    "service": 10,
+}
+
 # Number of seconds to sleep before sending HTTP response to client
 DELAY = 0.25
 
+# Python module with a server state dump to restore on startup, e.g.
+# "robobattleship.dumps.latest" (None - start with empty state)
+RESTORE_FROM = None
+
+# Seed of server random number generator, which seeds every new battle
+# (None - random seed)
+RANDOM_SEED = None
+
+# Number of seconds a player has to make a shot, otherwise he forfeits the
+# battle
+TURN_TIMEOUT = 60
+
+# Timer wheel settings: duration of one tick in seconds and number of slots
+TIMER_WHEEL_TICK = 1
+TIMER_WHEEL_SLOTS = 128
+
+# Elo rating settings: initial rating of a player and K-factor
+RATING_DEFAULT = 1000
+RATING_K = 32
+
+# Matchmaking settings: players are grouped by rating into buckets of
+# MATCH_RATING_BUCKET points and matched with players at most
+# MATCH_RATING_WINDOW buckets away. Player who didn't poll the queue for
+# MATCH_QUEUE_TIMEOUT seconds is considered gone.
+MATCH_RATING_BUCKET = 50
+MATCH_RATING_WINDOW = 4
+MATCH_QUEUE_TIMEOUT = 30
+
+# Write server dumps from a forked child process instead of the process
+# serving requests (where fork is available)
+SNAPSHOT_BACKGROUND = True
+
+# Number of seconds between periodic snapshots (0 - no periodic snapshots)
+# and dump file name for them
+SNAPSHOT_INTERVAL = 0
+SNAPSHOT_FILENAME = "latest.py"
+
+# Number of seconds between checks whether snapshot child process finished
+SNAPSHOT_POLL_INTERVAL = 0.1
+
+# Key which signs player tokens. All processes serving the same players must
+# share it, a random key is generated if it is not configured (tokens are
+# invalidated on restart then).
+AUTH_SECRET_KEY = os.environ.get("ROBOBATTLESHIP_AUTH_KEY") or \
+    binascii.hexlify(os.urandom(32)).decode("ascii")
+
+# Number of hex characters of HMAC-SHA256 in player token signature
+AUTH_SIGNATURE_LENGTH = 32
+
 # Administrator's email
 ADMIN_EMAIL = "andrey@popelo.com"
 
+# Administrator's secret which grants access to service methods like
+# profiler (empty - service methods are disabled)
+ADMIN_SECRET = os.environ.get("ROBOBATTLESHIP_ADMIN_SECRET", "")
+
+# Maximum number of seconds profiler can run for and number of top functions
+# in profiler report
+PROFILE_MAX_SECONDS = 60
+PROFILE_TOP = 40
+
+# Number of most common object types in server statistics
+STATS_TOP_OBJECTS = 30
+
 # Project's root directory
 PROJECT_ROOT = os.path.dirname(os.path.realpath(__file__))
 
@@ -28,13 +132,39 @@ DUMPS_ROOT = os.path.join(PROJECT_ROOT, "dumps")
 # Project's templates root directory
 TEMPLATES_ROOT = os.path.join(PROJECT_ROOT, "templates")
 
+# Project's compiled templates cache directory
+TEMPLATES_CACHE_ROOT = os.path.join(PROJECT_ROOT, "cache")
+
 # Project's static files root directory
 STATIC_ROOT = os.path.join(PROJECT_ROOT, "static")
 
+# Browser cache lifetime of static files (seconds) and of static files
+# requested by content-hashed urls, which never change
+STATIC_MAX_AGE = 3600
+STATIC_FINGERPRINTED_MAX_AGE = 365 * 24 * 3600
+
+# Static files with these extensions get prebuilt gzip variants
+STATIC_GZIP_EXTENSIONS = (".css", ".js", ".html", ".svg", ".txt", ".ico")
+
+# Compression level and minimal size (bytes) of gzip-compressed responses
+GZIP_LEVEL = 6
+GZIP_MIN_SIZE = 1024
+
 # Project's log root directory
 LOG_ROOT = os.path.join(PROJECT_ROOT, "logs")
 LOG_FILE = os.path.join(LOG_ROOT, "robobattleship.log")
 
+# Maximum number of log records waiting to be written, records which don't
+# fit are dropped
+LOG_QUEUE_SIZE = 10000
+
+# Number of seconds log writer thread sleeps when there are no records
+LOG_POLL_INTERVAL = 0.05
+
+# Maximum number of records per second with the same message below WARNING
+# level, the rest are dropped (0 - log everything)
+LOG_SAMPLE_RATE = 20
+
 # Logger config
 LOGGING = {
     'version': 1,
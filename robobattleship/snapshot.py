@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103
+"""
+This module contains background snapshots of server state.
+
+Snapshot is written by a forked child process: it gets a copy-on-write view
+of the whole server memory, so the parent process only pays for the fork
+and keeps serving requests while the child serializes and writes state.
+Fork happens with server lock held, so the child never sees a half-done
+state change.
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import time
+import threading
+
+import robobattleship.log
+from robobattleship.errors import RoboBattleshipException
+from robobattleship.settings import SNAPSHOT_POLL_INTERVAL, SNAPSHOT_FILENAME
+
+LOG = robobattleship.log.getLogger(__name__)
+
+
+class Snapshotter(object):
+    """
+    Takes snapshots of server state in a forked child process and keeps
+    statistics of the last snapshot.
+    """
+
+    def __init__(self):
+        self.pid = None
+        self.path = None
+        self.started = None
+        self.fork_duration = None
+        # statistics of the last finished snapshot
+        self.last = None
+        # makes checking for a running snapshot and starting one atomic
+        self.lock = threading.Lock()
+
+    def is_running(self):
+        "Returns True if a snapshot is being written"
+        return self.pid is not None
+
+    def start(self, server, filename=None):
+        """
+        Starts writing a snapshot of given server into a file with given
+        name in background. Concurrent calls don't start more than one
+        snapshot.
+        """
+        with self.lock:
+            if self.is_running():
+                raise RoboBattleshipException(104)
+
+            self.path = server.dump_path(filename)
+            self.started = time.time()
+
+            if not hasattr(os, "fork"):
+                # no fork on this platform, write snapshot inline
+                server.dumpstate(filename)
+                self.fork_duration = None
+                self.finish(0)
+                return
+
+            with server.lock:
+                pid = os.fork()
+            if pid == 0:
+                # child process: it is the only thread here, no locking
+                # needed
+                try:
+                    server.write_dump(repr(server), self.path)
+                    os._exit(0)
+                except:
+                    try:
+                        robobattleship.log.after_fork()
+                        LOG.exception("Failed to write snapshot '%s'",
+                            self.path)
+                    finally:
+                        os._exit(1)
+
+            self.pid = pid
+            self.fork_duration = time.time() - self.started
+            LOG.info("Started writing snapshot '%s' in process %s",
+                self.path, pid)
+
+            reaper = threading.Thread(target=self.wait)
+            reaper.daemon = True
+            reaper.start()
+
+    def wait(self):
+        "Waits for the child process to finish without blocking other threads"
+        while True:
+            pid, status = os.waitpid(self.pid, os.WNOHANG)
+            if pid:
+                self.finish(status)
+                return
+            time.sleep(SNAPSHOT_POLL_INTERVAL)
+
+    def finish(self, status):
+        "Records statistics of a finished snapshot"
+        success = status == 0
+        self.last = {
+            "filename": os.path.basename(self.path),
+            "time": self.started,
+            "duration": round(time.time() - self.started, 3),
+            "fork_duration": (round(self.fork_duration, 3)
+                              if self.fork_duration is not None else None),
+            "size": os.path.getsize(self.path) if success else None,
+            "success": success,
+        }
+        self.pid = None
+        if success:
+            LOG.info("Snapshot '%s' is written: %s", self.path, self.last)
+        else:
+            LOG.error("Failed to write snapshot '%s', exit status %s",
+                self.path, status)
+
+    def run_periodic(self, get_server, interval):
+        """
+        Infinite loop which takes a snapshot of the server returned by
+        get_server every interval seconds.
+        """
+        while True:
+            time.sleep(interval)
+            try:
+                if not self.is_running():
+                    self.start(get_server(), SNAPSHOT_FILENAME)
+            except:
+                LOG.exception("Failed to start periodic snapshot")
+
+    def status(self):
+        "Returns snapshot status and statistics of the last snapshot"
+        return {"running": self.is_running(), "last": self.last}
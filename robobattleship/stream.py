@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103
+"""
+This module contains RoboBattleship persistent connection protocol for bots.
+
+Bot opens a TCP connection, authenticates once and then sends commands, one
+per line, instead of making an HTTP request for every action:
+
+    AUTH <uid> <secret>
+    SETSHIPS <ships>
+    SHOOT <enemy_uid> <x> <y>
+    WAIT <enemy_uid>
+    MATCH
+    QUIT
+
+Every command gets a response line with the same JSON object as the
+corresponding REST API method returns (a line longer than STREAM_MAX_LINE
+gets an error and the connection is closed). In addition server sends an
+event line every time it becomes bot's turn to shoot in one of its battles:
+
+    {"event": "turn", "opponent": "<enemy_uid>", "bid": "<bid>"}
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import time
+import socket
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import robobattleship.log
+from robobattleship.utils import JsonResponse
+from robobattleship.errors import RoboBattleshipException, ValidationException
+from robobattleship.settings import (DELAY, STREAM_MAX_LINE,
+    STREAM_OUTBOX_SIZE, WAIT_TURN_TIMEOUT)
+
+LOG = robobattleship.log.getLogger(__name__)
+
+# Command name -> number of arguments
+COMMANDS = {
+    "AUTH": 2,
+    "SETSHIPS": 1,
+    "SHOOT": 3,
+    "WAIT": 1,
+    "MATCH": 0,
+}
+
+
+class StreamHandler(object):
+    """
+    Connection handler for gevent StreamServer.
+    """
+
+    def __init__(self, context):
+        self.context = context
+
+    def __call__(self, sock, address):
+        StreamConnection(self.context, sock, address).serve()
+
+
+class StreamConnection(object):
+    """
+    A single persistent connection with a bot.
+    """
+
+    def __init__(self, context, sock, address):
+        self.context = context
+        self.socket = sock
+        self.address = address
+        self.uid = None
+        # responses and events waiting to be sent
+        self.outbox = queue.Queue(STREAM_OUTBOX_SIZE)
+
+    def serve(self):
+        """
+        Reads and executes commands until bot disconnects.
+        """
+        writer = threading.Thread(target=self.write_loop)
+        writer.daemon = True
+        writer.start()
+
+        rfile = self.socket.makefile("rb")
+        try:
+            while True:
+                line = rfile.readline(STREAM_MAX_LINE)
+                if not line:
+                    break
+                if len(line) >= STREAM_MAX_LINE and not line.endswith(b"\n"):
+                    # the rest of the line would be read as another command
+                    self.outbox.put(JsonResponse.error(ValidationException(
+                        219, maxlength=STREAM_MAX_LINE)))
+                    break
+                args = line.decode("utf-8").split()
+                if not args:
+                    continue
+                if args[0].upper() == "QUIT":
+                    break
+                self.outbox.put(self.execute(args[0].upper(), args[1:]))
+        except socket.error:
+            pass
+        except:
+            LOG.exception("Failed to serve connection from %s", self.address)
+        finally:
+            if self.uid:
+                self.context.server.remove_turn_listener(self.uid,
+                                                         self.on_turn)
+            try:
+                self.outbox.put_nowait(None)
+            except queue.Full:
+                pass
+            writer.join(5)
+            self.socket.close()
+
+    def execute(self, command, args):
+        """
+        Executes command with given arguments and returns response packet.
+        """
+        if command not in COMMANDS:
+            return JsonResponse.error(216)
+        if len(args) != COMMANDS[command]:
+            return JsonResponse.error(201)
+        if command != "AUTH" and not self.uid:
+            return JsonResponse.error(217)
+
+        try:
+            time.sleep(DELAY)
+            return getattr(self, "do_" + command.lower())(*args)
+        except RoboBattleshipException as e:
+            return JsonResponse.error(e)
+        except:
+            LOG.exception("Failed to execute command %s %s from [%s]",
+                command, args, self.uid)
+            return JsonResponse.error(101)
+
+    def do_auth(self, uid, secret):
+        "Authenticates bot"
+        if not self.context.is_ready():
+            return JsonResponse.error(102)
+        # signed token is valid even for a player who isn't registered
+        if not self.context.server.is_player_registered(uid=uid):
+            raise ValidationException(204, uid=uid)
+        self.context.server.validate_player(uid, secret)
+        if self.uid:
+            self.context.server.remove_turn_listener(self.uid, self.on_turn)
+        self.uid = uid
+        self.context.server.add_turn_listener(uid, self.on_turn)
+        return JsonResponse.success()
+
+    def do_setships(self, ships):
+        "Sets bot's ships arrangement"
+        self.context.server.setships(self.uid, ships)
+        return JsonResponse.success()
+
+    def do_shoot(self, enemy_uid, x, y):
+        "Shoots at enemy"
+        result = self.context.server.shoot(self.uid, enemy_uid, x, y)
+        return JsonResponse.success({'result': result})
+
+    def do_wait(self, enemy_uid):
+        "Waits until it's bot's turn to shoot at enemy"
+        battle, turn = self.context.server.wait_turn(self.uid, enemy_uid,
+                                                     WAIT_TURN_TIMEOUT)
+        return JsonResponse.success({'turn': turn,
+                                     'active': battle.is_active()})
+
+    def do_match(self):
+        "Puts bot into matchmaking queue"
+        found = self.context.server.match(self.uid)
+        if found is None:
+            return JsonResponse.success({'opponent': None, 'bid': None})
+        opponent, bid = found
+        return JsonResponse.success({'opponent': opponent, 'bid': bid})
+
+    def on_turn(self, opponent, bid):
+        """
+        Turn listener: sends an event to bot. Events are dropped if bot
+        doesn't read them.
+        """
+        try:
+            self.outbox.put_nowait({"event": "turn", "opponent": opponent,
+                                    "bid": bid})
+        except queue.Full:
+            pass
+
+    def write_loop(self):
+        "Sends packets from outbox to bot"
+        while True:
+            packet = self.outbox.get()
+            if packet is None:
+                break
+            try:
+                self.socket.sendall((json.dumps(packet) + "\n").encode("utf-8"))
+            except socket.error:
+                break
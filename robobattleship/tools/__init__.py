@@ -0,0 +1,4 @@
+"""
+Developer tools of RoboBattleship game server: benchmarks and test
+harnesses.
+"""
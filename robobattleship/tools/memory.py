@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103
+"""
+Memory benchmark: measures how many bytes an active and an archived battle
+take on the server.
+
+    $ python -m robobattleship.tools.memory --battles 1000
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import sys
+import random
+import argparse
+
+from robobattleship.server import Server
+from robobattleship.players.stupid import SHIPS1, SHIPS2, SHIPS3, SHIPS4, SHIPS5
+
+
+# Objects of these types are shared by the whole process, they are not
+# counted
+SKIP_TYPES = (type, type(sys), type(len), type(lambda: None))
+
+
+def deepsize(obj, seen):
+    """
+    Returns size of object and all objects it references in bytes. Objects
+    with ids in seen set are not counted (again).
+    """
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, SKIP_TYPES):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        else:
+            if hasattr(obj, "__dict__"):
+                stack.append(obj.__dict__)
+            for cls in type(obj).__mro__:
+                for name in cls.__dict__.get("__slots__", ()):
+                    if hasattr(obj, name):
+                        stack.append(getattr(obj, name))
+    return size
+
+
+def create_players(server, count):
+    "Registers players with ships and returns their uids"
+    uids = []
+    for i in range(count):
+        player = server.register_player("Player %s" % i)
+        server.setships(player.uid, random.choice(
+            [SHIPS1, SHIPS2, SHIPS3, SHIPS4, SHIPS5]))
+        uids.append(player.uid)
+    return uids
+
+
+def play(server, p1uid, p2uid):
+    "Plays battle between two players until one of them wins"
+    cells = {}
+    for uid in (p1uid, p2uid):
+        cells[uid] = [(x, y) for x in range(10) for y in range(10)]
+        random.shuffle(cells[uid])
+
+    battle = server.get_or_create_battle(p1uid, p2uid)
+    while battle.is_active():
+        shooter = battle.shooter.uid
+        opponent = battle.opponent.uid
+        x, y = cells[shooter].pop()
+        server.shoot(shooter, opponent, x, y)
+
+
+def main():
+    "Runs memory benchmark"
+    parser = argparse.ArgumentParser(
+        description="Measure memory used by active and archived battles")
+    parser.add_argument("--battles", type=int, default=1000,
+                        help="number of battles")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    server = Server()
+    uids = create_players(server, args.battles * 2)
+    pairs = list(zip(uids[::2], uids[1::2]))
+
+    # registered players and their ships are not part of battles
+    seen = set()
+    deepsize(server.players, seen)
+    deepsize(server.ships, seen)
+
+    for p1uid, p2uid in pairs:
+        server.get_or_create_battle(p1uid, p2uid)
+    active = deepsize(list(server.battles.values()), set(seen))
+
+    for p1uid, p2uid in pairs:
+        play(server, p1uid, p2uid)
+    archived = deepsize(list(server.archived_battles.values()), set(seen))
+    shots = sum(len(b.shots) for b in server.archived_battles.values())
+
+    print("Battles:                    %s" % args.battles)
+    print("Bytes per active battle:    %s" % (active // args.battles))
+    print("Bytes per archived battle:  %s" % (archived // args.battles))
+    print("Shots per archived battle:  %s" % (shots // args.battles))
+
+
+if __name__ == "__main__":
+    main()
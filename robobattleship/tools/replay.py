@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103
+"""
+Replay regression suite: re-executes battles exported by
+robobattleship.export through Battle.shoot and checks that every shot has
+the same result as recorded, and that shots are fast enough.
+
+    $ python -m robobattleship.export robobattleship/dumps/latest.py \\
+        --gzip > battles.ndjson.gz
+    $ python -m robobattleship.tools.replay battles.ndjson.gz --repeat 5
+
+Exit status is 1 if a battle didn't replay the same way or a timing budget
+was exceeded.
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import sys
+import gzip
+import json
+import time
+import argparse
+
+from robobattleship.player import Player, PlayerWithShips
+from robobattleship.battle import (Battle, CELL_EMPTY, CELL_SHIP, CELL_MISS,
+    CELL_HIT)
+from robobattleship.errors import RoboBattleshipException
+
+
+# Final board cell -> cell before the battle
+INITIAL_CELLS = {CELL_HIT: CELL_SHIP, CELL_MISS: CELL_EMPTY}
+
+
+def initial_ships(rows):
+    "Returns ships arrangement before the battle given the final board"
+    return [[INITIAL_CELLS.get(cell, cell) for cell in row] for row in rows]
+
+
+def create_battle(data):
+    """
+    Creates exported battle in its initial state. Battles with a recorded
+    seed choose the first shooter themselves, so the choice is checked too.
+    """
+    players = [PlayerWithShips(Player(p["name"], uid=p["uid"], secret="-"),
+                               initial_ships(p["ships"]))
+               for p in data["players"]]
+    if data.get("seed") is not None:
+        return Battle(players[0], players[1], seed=data["seed"])
+    shooter_uid = data["shots"][0]["uid"] if data["shots"] else None
+    return Battle(players[0], players[1], shooter_uid=shooter_uid)
+
+
+def replay(data):
+    """
+    Replays exported battle. Returns a tuple (list of mismatches, list of
+    shot durations in seconds).
+    """
+    battle = create_battle(data)
+    mismatches = []
+    durations = []
+
+    shots = data["shots"]
+    if shots and battle.shooter.uid != shots[0]["uid"]:
+        mismatches.append("first shooter is %s instead of %s" %
+                          (battle.shooter.uid, shots[0]["uid"]))
+        return mismatches, durations
+
+    for n, shot in enumerate(shots, 1):
+        started = time.time()
+        try:
+            result = battle.shoot(shot["uid"], shot["x"], shot["y"])
+        except RoboBattleshipException as e:
+            result = e.code
+        durations.append(time.time() - started)
+        if result != shot["result"]:
+            mismatches.append("shot %s at [%s,%s] is '%s' instead of '%s'" %
+                              (n, shot["x"], shot["y"], result,
+                               shot["result"]))
+            return mismatches, durations
+
+    # battle without a winning shot was forfeited
+    if data["winner"] and battle.is_active():
+        battle.forfeit(data["looser"])
+    winner = battle.winner.uid if battle.winner else None
+    if winner != data["winner"]:
+        mismatches.append("winner is %s instead of %s" %
+                          (winner, data["winner"]))
+
+    for player, recorded in zip((battle.player1, battle.player2),
+                                data["players"]):
+        if ["".join(row) for row in player.ships] != recorded["ships"]:
+            mismatches.append("final board of %s differs" % player.uid)
+    return mismatches, durations
+
+
+def read_battles(path):
+    "Yields battles from an exported (optionally gzipped) file"
+    with open(path, "rb") as f:
+        gzipped = f.read(2) == b"\x1f\x8b"
+    stream = gzip.open(path, "rb") if gzipped else io.open(path, "rb")
+    with io.TextIOWrapper(stream, encoding="utf-8") as lines:
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+
+
+def main():
+    "Replays exported battles and checks results and timing"
+    parser = argparse.ArgumentParser(
+        description="Replay exported battles and check results and timing")
+    parser.add_argument("files", nargs="+",
+                        help="exported battles (newline-delimited JSON, "
+                             "optionally gzipped)")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="replay every battle given number of times, the "
+                             "fastest run is timed")
+    parser.add_argument("--shot-budget", type=float, default=500,
+                        help="maximum average shot duration in microseconds")
+    parser.add_argument("--battle-budget", type=float, default=None,
+                        help="maximum battle replay duration in milliseconds")
+    args = parser.parse_args()
+
+    failures = []
+    battles = shots = 0
+    total = 0.0
+    slowest = (0.0, None)
+    for path in args.files:
+        for data in read_battles(path):
+            runs = []
+            for _ in range(args.repeat):
+                mismatches, durations = replay(data)
+                if mismatches:
+                    break
+                runs.append(sum(durations))
+            for mismatch in mismatches:
+                failures.append("%s: %s" % (data["bid"], mismatch))
+            if not runs:
+                continue
+
+            battles += 1
+            shots += len(data["shots"])
+            total += min(runs)
+            slowest = max(slowest, (min(runs), data["bid"]))
+
+    average = total / shots * 10 ** 6 if shots else 0
+    print("Battles:              %s" % battles)
+    print("Shots:                %s" % shots)
+    print("Average shot:         %.1f us" % average)
+    print("Slowest battle:       %.3f ms (%s)" % (slowest[0] * 1000,
+                                                  slowest[1]))
+
+    if average > args.shot_budget:
+        failures.append("average shot takes %.1f us, budget is %s us" %
+                        (average, args.shot_budget))
+    if args.battle_budget is not None and \
+            slowest[0] * 1000 > args.battle_budget:
+        failures.append("battle %s takes %.3f ms, budget is %s ms" %
+                        (slowest[1], slowest[0] * 1000, args.battle_budget))
+
+    for failure in failures:
+        print("FAIL: %s" % failure, file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103
+"""
+Soak test: drives a server with a churning population of bots for hours,
+samples its memory, state sizes and shoot latency over time and fails if
+they grow over budgets.
+
+    $ python -m robobattleship.tools.soak --spawn --duration 14400 --bots 20 \\
+        --secret <admin secret>
+
+Every sample is printed as a line of JSON. Exit status is 1 if a budget was
+exceeded.
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import subprocess
+
+import requests
+
+from robobattleship.players.stupid import StupidBot
+from robobattleship.settings import (PORT, STREAM_PORT, PROJECT_ROOT,
+    ADMIN_SECRET)
+
+
+class LatencyRecorder(object):
+    "Collects durations of requests made by all bots"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = []
+
+    def record(self, seconds):
+        "Adds duration of a request"
+        with self.lock:
+            self.values.append(seconds)
+
+    def drain(self):
+        "Returns durations recorded since the last call"
+        with self.lock:
+            values, self.values = self.values, []
+        return values
+
+
+class SoakBot(StupidBot):
+    """
+    StupidBot which records latency of its shots and stops fighting after
+    its lifetime is over.
+    """
+
+    def __init__(self, recorder, lifetime, **kwargs):
+        super(SoakBot, self).__init__(**kwargs)
+        self.daemon = True
+        self.recorder = recorder
+        self.lifetime = lifetime
+
+    def run(self):
+        timer = threading.Timer(self.lifetime, self.stop_fight)
+        timer.daemon = True
+        timer.start()
+        try:
+            super(SoakBot, self).run()
+        finally:
+            timer.cancel()
+
+    def shoot(self, opponent, x, y):
+        started = time.time()
+        try:
+            return super(SoakBot, self).shoot(opponent, x, y)
+        finally:
+            self.recorder.record(time.time() - started)
+
+
+class Population(object):
+    """
+    Keeps given number of bots fighting: bots retire after a random
+    lifetime and new bots register instead of them.
+    """
+
+    def __init__(self, url, size, lifetime, recorder, stream_address=None):
+        self.url = url
+        self.size = size
+        self.lifetime = lifetime
+        self.recorder = recorder
+        self.stream_address = stream_address
+        self.bots = []
+        self.started = 0
+        # random part of bot names, so reruns against the same server don't
+        # clash with already registered names
+        self.run_id = "%06x" % random.getrandbits(24)
+
+    def refill(self):
+        "Replaces retired bots with new ones"
+        self.bots = [bot for bot in self.bots if bot.is_alive()]
+        while len(self.bots) < self.size:
+            self.started += 1
+            bot = SoakBot(self.recorder,
+                          random.uniform(self.lifetime / 2.0, self.lifetime),
+                          server_url=self.url,
+                          name="Soak %s-%s" % (self.run_id, self.started),
+                          stream_address=self.stream_address,
+                          seed=random.getrandbits(32))
+            bot.start()
+            self.bots.append(bot)
+
+    def stop(self):
+        "Tells all bots to stop fighting"
+        for bot in self.bots:
+            bot.stop_fight()
+
+
+def percentile(values, percent):
+    "Returns given percentile of a list of values"
+    if not values:
+        return None
+    values = sorted(values)
+    return values[int(round(percent / 100.0 * (len(values) - 1)))]
+
+
+def sample(url, secret, recorder):
+    "Returns a sample of server statistics and shoot latency"
+    response = requests.get(url + "stats/" + secret, params={"objects": "1"},
+                            timeout=60).json()
+    if "stats" not in response:
+        raise RuntimeError("Failed to get server statistics: %s" %
+                           response.get("error"))
+    stats = response["stats"]
+    latencies = recorder.drain()
+    return {
+        "time": time.time(),
+        "rss": stats["memory"]["rss"],
+        "objects": stats["memory"]["objects"],
+        "types": stats["memory"]["types"],
+        "server": stats["server"],
+        "shoot": {
+            "count": len(latencies),
+            "p50": percentile(latencies, 50),
+            "p90": percentile(latencies, 90),
+            "p99": percentile(latencies, 99),
+        },
+    }
+
+
+def check(baseline, current, args):
+    """
+    Returns a list of budgets the current sample exceeds compared to the
+    baseline one.
+    """
+    failures = []
+    growth = (current["rss"] - baseline["rss"]) / 2.0 ** 20
+    if growth > args.rss_budget:
+        failures.append("RSS grew by %.1f MB" % growth)
+
+    growth = current["objects"] / float(baseline["objects"]) - 1
+    if growth > args.objects_budget:
+        grown = sorted(current["types"], reverse=True,
+                       key=lambda t: current["types"][t] -
+                                     baseline["types"].get(t, 0))
+        failures.append("Number of objects grew by %.0f%%, most grown: %s" %
+                        (growth * 100, ", ".join(grown[:5])))
+
+    if current["server"]["battles"] > args.battles_budget:
+        failures.append("%s active battles" % current["server"]["battles"])
+
+    before, after = baseline["shoot"]["p99"], current["shoot"]["p99"]
+    if before and after and after > before * args.latency_budget:
+        failures.append("Shoot latency p99 grew from %.3f to %.3f sec" %
+                        (before, after))
+    return failures
+
+
+def wait_ready(url, timeout):
+    "Waits until server is ready to accept requests"
+    deadline = time.time() + timeout
+    while True:
+        try:
+            if requests.get(url + "readyz", timeout=5).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        if time.time() > deadline:
+            raise RuntimeError("Server at %s isn't ready" % url)
+        time.sleep(1)
+
+
+def main():
+    "Runs soak test"
+    parser = argparse.ArgumentParser(
+        description="Soak test a server with a churning population of bots")
+    parser.add_argument("--url", default="http://127.0.0.1:%s/" % PORT,
+                        help="server url")
+    parser.add_argument("--spawn", action="store_true",
+                        help="start a server process for the test")
+    parser.add_argument("--stream", action="store_true",
+                        help="bots use persistent connections")
+    parser.add_argument("--duration", type=float, default=4 * 3600,
+                        help="test duration in seconds")
+    parser.add_argument("--interval", type=float, default=60,
+                        help="seconds between samples")
+    parser.add_argument("--warmup", type=float, default=300,
+                        help="seconds before the baseline sample")
+    parser.add_argument("--bots", type=int, default=20,
+                        help="number of bots fighting at the same time")
+    parser.add_argument("--lifetime", type=float, default=600,
+                        help="maximum number of seconds a bot fights")
+    parser.add_argument("--rss-budget", type=float, default=100,
+                        help="maximum RSS growth in MB")
+    parser.add_argument("--objects-budget", type=float, default=1.0,
+                        help="maximum growth of number of objects (ratio)")
+    parser.add_argument("--battles-budget", type=int, default=None,
+                        help="maximum number of active battles "
+                             "(default: number of bots)")
+    parser.add_argument("--latency-budget", type=float, default=2.0,
+                        help="maximum growth of shoot latency p99 (ratio)")
+    parser.add_argument("--seed", type=int, default=None, help="random seed")
+    parser.add_argument("--secret", default=ADMIN_SECRET,
+                        help="administrator's secret, needed to count objects "
+                             "(default: ROBOBATTLESHIP_ADMIN_SECRET)")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    if not args.secret:
+        parser.error("administrator's secret is required, set "
+                     "ROBOBATTLESHIP_ADMIN_SECRET or pass --secret")
+    if args.battles_budget is None:
+        args.battles_budget = args.bots
+    if not args.url.endswith("/"):
+        args.url += "/"
+
+    process = None
+    if args.spawn:
+        process = subprocess.Popen([sys.executable, PROJECT_ROOT],
+            stdout=open(os.devnull, "w"), stderr=subprocess.STDOUT,
+            env=dict(os.environ, ROBOBATTLESHIP_ADMIN_SECRET=args.secret))
+    recorder = LatencyRecorder()
+    stream_address = ("127.0.0.1", STREAM_PORT) if args.stream else None
+    population = Population(args.url, args.bots, args.lifetime, recorder,
+                            stream_address)
+
+    failures = []
+    try:
+        wait_ready(args.url, 60)
+        started = time.time()
+        baseline = None
+        while time.time() - started < args.duration:
+            population.refill()
+            time.sleep(args.interval)
+
+            current = sample(args.url, args.secret, recorder)
+            current["bots"] = population.started
+            print(json.dumps(current))
+            sys.stdout.flush()
+
+            if baseline is None:
+                if time.time() - started >= args.warmup:
+                    baseline = current
+                continue
+            failures = check(baseline, current, args)
+            if failures:
+                break
+    finally:
+        population.stop()
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    for failure in failures:
+        print("FAIL: %s" % failure, file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103
+"""
+This module keeps functions which gevent monkey patching replaces, for code
+which has to run in a real OS thread (log writer). It must be imported
+before monkey.patch_all(), since gevent 0.13 doesn't keep the originals.
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import time
+try:
+    import thread
+except ImportError:
+    import _thread as thread
+
+
+def original(module, name, current):
+    """
+    Returns given function if it isn't patched by gevent, otherwise asks
+    gevent for the original one (gevent 1.0+ only).
+    """
+    if not getattr(current, "__module__", "").startswith("gevent"):
+        return current
+    try:
+        from gevent.monkey import get_original
+    except ImportError:
+        return current
+    return get_original(module, name)
+
+
+start_new_thread = original(thread.__name__, "start_new_thread",
+                            thread.start_new_thread)
+allocate_lock = original(thread.__name__, "allocate_lock",
+                         thread.allocate_lock)
+sleep = original("time", "sleep", time.sleep)
+
+# True if the functions above are gevent ones after all
+PATCHED = any(getattr(f, "__module__", "").startswith("gevent")
+              for f in (start_new_thread, allocate_lock, sleep))
@@ -6,11 +6,20 @@ This module contains various utility functions.
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import gc
+import sys
+import hmac
 import time
 import functools
+from collections import Counter
+try:
+    import resource
+except ImportError:
+    resource = None
 
-from robobattleship.errors import RoboBattleshipException, ERRORS
-from robobattleship.settings import DELAY
+from robobattleship.errors import (RoboBattleshipException,
+    ValidationException, ERRORS)
+from robobattleship.settings import DELAY, ADMIN_SECRET
 
 
 class JsonResponse(object):
@@ -46,6 +55,53 @@ class JsonResponse(object):
         return packet
 
 
+def validate_admin(secret):
+    """
+    Throws ValidationException if given secret is not administrator's
+    secret.
+    """
+    if not ADMIN_SECRET or not secret or \
+            not constant_time_compare(secret, ADMIN_SECRET):
+        raise ValidationException(215)
+
+
+def constant_time_compare(val1, val2):
+    """
+    Returns True if two strings are equal. Time of comparison doesn't depend
+    on how many characters match.
+    """
+    if hasattr(hmac, "compare_digest"):
+        return hmac.compare_digest(val1.encode("utf-8"), val2.encode("utf-8"))
+    if len(val1) != len(val2):
+        return False
+    result = 0
+    for x, y in zip(val1, val2):
+        result |= ord(x) ^ ord(y)
+    return result == 0
+
+
+def rss():
+    """
+    Returns resident set size of the process in bytes. Returns peak size
+    where current one is not available (outside Linux).
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except (IOError, OSError, ValueError, IndexError):
+        if resource is None:
+            return None
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage if sys.platform == "darwin" else usage * 1024
+
+
+def object_counts():
+    """
+    Returns Counter of objects tracked by garbage collector per type name.
+    """
+    return Counter(type(obj).__name__ for obj in gc.get_objects())
+
+
 def delay(seconds=DELAY):
     """
     Decorator: makes a delay before executing code of a function.